@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+from database import Database, Field, Row
+
+TRANSACTION_FIELDS = [
+    Field('id', 'id'),
+    Field('account_id', 'index integer'),
+    Field('destination_id', 'index integer'),
+    Field('amount', 'integer'),
+    Field('description', 'char(200)'),
+    Field('created_time', 'timestamp'),
+]
+START_TIME = datetime(2024, 1, 1)
+
+
+def transaction_values(count):
+    return [
+        [index, index % 1000, index % 997, index * 10, 'Transfer money', f'2024-01-01T00:{index % 60:02}:00']
+        for index in range(1, count + 1)
+    ]
+
+
+def allocated(build):
+    """Bytes allocated by `build()` that are still alive when it returns, and its result."""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def row_memory(count):
+    """Bytes per row of a transactions table stored as dicts (one per csv.DictReader row) and as tuples."""
+    names = [field.name for field in TRANSACTION_FIELDS]
+    columns = {name: offset for offset, name in enumerate(names)}
+    values = transaction_values(count)
+    dict_size, dict_rows = allocated(lambda: {item[0]: dict(zip(names, item)) for item in values})
+    tuple_size, tuple_rows = allocated(lambda: {item[0]: tuple(item) for item in values})
+    assert all(Row(columns, tuple_rows[item_id]) == dict_rows[item_id] for item_id in list(dict_rows)[:100])
+    return {
+        'rows': count,
+        'dict_bytes_per_row': round(dict_size / count, 1),
+        'tuple_bytes_per_row': round(tuple_size / count, 1),
+    }
+
+
+def national_number(index):
+    """The `index`-th ten digit national number, with the check digit `validate_national_number` expects."""
+    digits = f'{index:09}'
+    remaining = sum(int(digit) * (10 - position) for position, digit in enumerate(digits)) % 11
+    return digits + str(remaining if remaining < 2 else 11 - remaining)
+
+
+def timestamp(rng):
+    return (START_TIME + timedelta(seconds=rng.randrange(365 * 24 * 3600))).isoformat()
+
+
+def generate_users(count, rng):
+    for index in range(1, count + 1):
+        yield {
+            'id': index,
+            'name': f'User {index}',
+            'phone_number': f'912{rng.randrange(10 ** 7):07}',
+            'password': f'password{index}',
+            'email': f'user{index}@example.com',
+            'national_number': national_number(index),
+        }
+
+
+def generate_accounts(count, users, rng):
+    for index in range(1, count + 1):
+        yield {
+            'id': index,
+            'user_id': (index - 1) % users + 1,
+            'amount': rng.randrange(10 ** 3, 10 ** 7),
+            'number': str(10000 + index * 7),
+            'password': f'password{index}',
+            'alias': f'account {index}',
+            'created_time': timestamp(rng),
+            'version': 1,
+        }
+
+
+def generate_transactions(count, accounts, rng):
+    for index in range(1, count + 1):
+        yield {
+            'id': index,
+            'account_id': rng.randrange(1, accounts + 1),
+            'destination_id': rng.randrange(0, accounts + 1),
+            'amount': rng.randrange(1, 10 ** 5),
+            'description': rng.choice(['Transfer money', 'Bill payment', 'Open account']),
+            'created_time': timestamp(rng),
+        }
+
+
+def generate_bills(count, users, rng):
+    for index in range(1, count + 1):
+        yield {
+            'id': index,
+            'user_id': rng.randrange(1, users + 1),
+            'amount': rng.randrange(1, 10 ** 5),
+            'description': rng.choice(['Electricity', 'Water', 'Gas', 'Phone']),
+            'bill_id': index,
+            'payment_code': rng.randrange(10 ** 5, 10 ** 6),
+            'status': rng.random() < 0.5,
+        }
+
+
+def scale(rows):
+    """Row count of every table for `rows` transactions."""
+    users = max(1, rows // 50)
+    return {'users': users, 'accounts': users * 2, 'transactions': rows, 'bills': users * 2}
+
+
+def generate(db, rows, seed=0):
+    """Write snapshots of every table of `db` with synthetic rows, `rows` is the number of transactions."""
+    rng = random.Random(seed)
+    counts = scale(rows)
+    generators = {
+        'users': generate_users(counts['users'], rng),
+        'accounts': generate_accounts(counts['accounts'], counts['users'], rng),
+        'transactions': generate_transactions(counts['transactions'], counts['accounts'], rng),
+        'bills': generate_bills(counts['bills'], counts['users'], rng),
+    }
+    for name, items in generators.items():
+        table = db.schema[name]
+        data = table.storage.rows()
+        for item in items:
+            data[item['id']] = tuple(item[field_name] for field_name in table.fields)
+        table.storage.write(data)
+        table.storage.close()
+    return counts
+
+
+def timed(operations):
+    """Run every callable of `operations` and report their latency."""
+    latencies = []
+    started = time.perf_counter()
+    for operation in operations:
+        operation_started = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - operation_started)
+    total = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'operations': len(latencies),
+        'seconds': round(total, 4),
+        'operations_per_second': round(len(latencies) / total, 1) if total else None,
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 4) if latencies else None,
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 4) if latencies else None,
+    }
+
+
+def run(schema, storage_path, rows, operations, seed=0, load_workers=0, durability='sync'):
+    """Generate the tables, then time startup, lookups, selects, inserts, transfers and deletes on them."""
+    with redirect_stdout(sys.stderr):
+        counts = generate(Database(schema, storage_path), rows, seed)
+        rng = random.Random(seed + 1)
+        results = {}
+
+        started = time.perf_counter()
+        db = Database(schema, storage_path, load_workers=load_workers, durability=durability)
+        results['startup'] = {}
+        for name in db.schema:
+            db.get_table(name)
+            results['startup'][name] = round(db.schema[name].load_time, 4)
+        results['startup']['total'] = round(time.perf_counter() - started, 4)
+
+        by_number = db.prepare('select from accounts where number == ?;')
+        by_national_number = db.prepare('select from users where national_number == ?;')
+        results['point_lookup_account_number'] = timed(
+            lambda number=str(10000 + rng.randrange(1, counts['accounts'] + 1) * 7): by_number.execute(number)
+            for _ in range(operations)
+        )
+        results['point_lookup_national_number'] = timed(
+            lambda number=national_number(rng.randrange(1, counts['users'] + 1)): by_national_number.execute(number)
+            for _ in range(operations)
+        )
+
+        account_history = db.prepare('select from transactions where account_id == ? or destination_id == ?;')
+        large_transactions = db.prepare('select from transactions where account_id == ? and amount > ?;')
+        unpaid_bills = db.prepare('select from bills where user_id == ? and status == ?;')
+        results['select_account_history'] = timed(
+            lambda account=rng.randrange(1, counts['accounts'] + 1): account_history.execute(account, account)
+            for _ in range(operations)
+        )
+        results['select_multi_condition'] = timed(
+            lambda account=rng.randrange(1, counts['accounts'] + 1): large_transactions.execute(account, 50000)
+            for _ in range(operations)
+        )
+        results['select_unpaid_bills'] = timed(
+            lambda user=rng.randrange(1, counts['users'] + 1): unpaid_bills.execute(user, False)
+            for _ in range(operations)
+        )
+        results['scan_month'] = timed(
+            lambda: db.run_query('select from transactions where created_time between 2024-03-01 and 2024-03-31;')
+            for _ in range(10)
+        )
+
+        insert_transaction = db.prepare(
+            'insert into transactions (account_id, destination_id, amount, description, created_time) '
+            'values (?, ?, ?, ?, ?);'
+        )
+        results['insert'] = timed(
+            lambda account=rng.randrange(1, counts['accounts'] + 1): insert_transaction.execute(
+                account, 0, 100, 'Benchmark', START_TIME.isoformat())
+            for _ in range(operations)
+        )
+        batch = list(generate_transactions(operations * 10, counts['accounts'], rng))
+        for item in batch:
+            del item['id']
+        results['insert_many'] = timed([lambda: db.insert_many('transactions', batch)])
+        results['insert_many']['rows'] = len(batch)
+
+        withdraw = db.prepare('update accounts set amount = amount - ? where id == ?;')
+        deposit = db.prepare('update accounts set amount = amount + ? where id == ?;')
+
+        def transfer(source, destination, amount=1):
+            with db.transaction():
+                withdraw.execute(amount, source)
+                deposit.execute(amount, destination)
+                insert_transaction.execute(source, destination, amount, 'Transfer money', START_TIME.isoformat())
+
+        results['transfer'] = timed(
+            lambda source=rng.randrange(1, counts['accounts'] + 1), destination=rng.randrange(1, counts['accounts'] + 1):
+            transfer(source, destination)
+            for _ in range(operations)
+        )
+
+        delete_transaction = db.prepare('delete from transactions where id == ?;')
+        results['delete'] = timed(
+            lambda item_id=item_id: delete_transaction.execute(item_id)
+            for item_id in rng.sample(range(1, counts['transactions'] + 1), min(operations, counts['transactions']))
+        )
+        db.close()
+    return {'rows': counts, 'operations': operations, 'seed': seed, 'load_workers': load_workers,
+            'durability': durability, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Storage engine benchmarks, results are printed as JSON.')
+    parser.add_argument('--rows', type=int, default=100000, help='number of transactions, other tables scale with it')
+    parser.add_argument('--operations', type=int, default=1000, help='operations timed by each benchmark')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--schema', default='schema.txt')
+    parser.add_argument('--storage', help='directory for the generated tables, a temporary one by default')
+    parser.add_argument('--load-workers', type=int, default=0, help='load the tables at startup in this many processes')
+    parser.add_argument('--durability', choices=['sync', 'group', 'async'], default='sync')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--row-memory', action='store_true', help='only measure the memory used per row')
+    args = parser.parse_args()
+
+    if args.row_memory:
+        report = {'row_memory': row_memory(args.rows)}
+    else:
+        storage_path = args.storage or tempfile.mkdtemp(prefix='benchmark-')
+        if os.path.exists(storage_path) and os.listdir(storage_path):
+            sys.exit(f'{storage_path} is not empty.')
+        try:
+            report = run(args.schema, storage_path, args.rows, args.operations, args.seed, args.load_workers,
+                         args.durability)
+        finally:
+            if not args.storage:
+                shutil.rmtree(storage_path)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
@@ -0,0 +1,90 @@
+import socket
+from contextlib import contextmanager
+
+from server import FRAME_HEADER, encode_frame, decode_body
+
+
+def connect(address):
+    """Socket to a server at `host:port`, or at a Unix socket path."""
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return socket.create_connection((host, int(port)))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(address)
+    return sock
+
+
+class RemoteStatement:
+    """Client side of `PreparedStatement`, the statement is prepared and cached by the server."""
+
+    def __init__(self, database, query):
+        self.database = database
+        self.query = query
+
+    def execute(self, *parameters):
+        return self.database.call('execute', query=self.query, parameters=list(parameters))
+
+    def iter(self, *parameters):
+        return iter(self.execute(*parameters))
+
+
+class RemoteDatabase:
+    """The part of the `Database` API used by the models, run by a server started with `python server.py`.
+
+    Rows come back as dicts.
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.socket = connect(address)
+        self.file = self.socket.makefile('rb')
+
+    def call(self, method, **arguments):
+        self.socket.sendall(encode_frame({'method': method, **arguments}))
+        header = self.file.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            raise RuntimeError(f'Connection to {self.address} closed.')
+        (size,) = FRAME_HEADER.unpack(header)
+        response = decode_body(self.file.read(size))
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    def prepare(self, query: str):
+        return RemoteStatement(self, query)
+
+    def run_query(self, query: str):
+        return self.call('run_query', query=query)
+
+    def insert_many(self, table_name, rows):
+        return self.call('insert_many', table=table_name, rows=list(rows))
+
+    def next_value(self, table_name, field_name, step=1):
+        return self.call('next_value', table=table_name, field=field_name, step=step)
+
+    def metrics(self):
+        return self.call('metrics')
+
+    def begin(self):
+        self.call('begin')
+
+    def commit(self):
+        self.call('commit')
+
+    def rollback(self):
+        self.call('rollback')
+
+    @contextmanager
+    def transaction(self):
+        """Run the enclosed queries atomically, other clients wait until the transaction ends."""
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
@@ -1,55 +1,555 @@
 import os
 import csv
 import re
+import time
+import heapq
+import threading
+import bisect
+from operator import itemgetter
+from itertools import islice
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from collections.abc import Mapping
+from contextlib import contextmanager, ExitStack
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def parse_condition(table, condition_str):
-    def evaluate_simple_condition(data, condition):
-        if match := re.search('\s*(\w*)\s*(==|!=)\s*\"?(([^\"]+))\"?', condition):
-            field = match.group(1)
-            operand = match.group(2)
-            value = match.group(3).strip()
-            if operand not in ['==', '!=']:
-                raise RuntimeError(f'Operand not supported: {operand}')
+from metrics import Metrics
+from storage import STORAGE_ENGINES, CsvStorage, BinaryStorage
+from query import Parser, PlanCache, Parameter, Select, Insert, Update, Delete, Begin, Commit, Rollback, Comparison, Between, \
+    Or, Name, BinaryOperation, AGGREGATES
+
+LOG_CHECKPOINT_RECORDS = 1000
+JOURNAL_SYNC_RECORDS = 1000
+LOAD_CHUNK_BYTES = 4 * 1024 * 1024
+LOCK_TIMEOUT = 30
+STREAM_BATCH_ROWS = 1024
+SEQUENCE_PATTERN = re.compile(r'sequence(?:\((\d+)\))?')
+CHAR_PATTERN = re.compile(r'^\s*char\((.*)\)$')
+FALSE_VALUES = ('0', 'False', 'false')
+
+
+class Durability:
+    SYNC = 'sync'
+    GROUP = 'group'
+    ASYNC = 'async'
+
+
+def check_durability(durability):
+    if durability not in [Durability.SYNC, Durability.GROUP, Durability.ASYNC]:
+        raise RuntimeError(f'Invalid durability {durability}')
+    return durability
+
+
+class LockMode:
+    INTENT = 'intent'
+    WRITE = 'write'
+
+
+class Condition:
+    """A WHERE clause compiled against a table.
+
+    `predicate` tests a single row and short-circuits AND/OR, `lookup` returns the exact ids matching the clause from
+    the indexes, or is None when part of the clause can only be answered by scanning. `exact` marks lookups made of
+    equalities only, which return few ids without walking a range.
+    """
+
+    def __init__(self, predicate, lookup=None, exact=False):
+        self.predicate = predicate
+        self.lookup = lookup
+        self.exact = exact
+
+
+def parameter_value(parameter, parameters):
+    try:
+        return parameters[parameter.index]
+    except IndexError:
+        raise RuntimeError(f'No value bound for parameter {parameter.index + 1}')
+
+
+def bind(field, value, parameters):
+    """Parse a query literal, or coerce the parameter bound to a placeholder, to the type of `field`."""
+    if isinstance(value, Parameter):
+        return field.coerce(parameter_value(value, parameters))
+    return field.coerce(value)
+
+
+def bind_values(values, parameters):
+    return [parameter_value(value, parameters) if isinstance(value, Parameter) else value for value in values]
+
+
+def compile_condition(table, node, parameters=()):
+    if isinstance(node, Comparison):
+        return compile_comparison(table, node, parameters)
+    if isinstance(node, Between):
+        field = condition_field(table, node.field)
+        return compile_range(table, field, bind(field, node.low, parameters), bind(field, node.high, parameters))
+    conditions = [compile_condition(table, condition, parameters) for condition in node.conditions]
+    predicates = [condition.predicate for condition in conditions]
+    indexed = [condition.lookup for condition in conditions if condition.lookup is not None]
+    if isinstance(node, Or):
+        def predicate(item):
+            for condition_predicate in predicates:
+                if condition_predicate(item):
+                    return True
+            return False
+
+        def lookup():
+            return set().union(*[condition_lookup() for condition_lookup in indexed])
+
+        exact = all(condition.exact for condition in conditions)
+        return Condition(predicate, lookup if len(indexed) == len(conditions) else None, exact)
+
+    def predicate(item):
+        for condition_predicate in predicates:
+            if not condition_predicate(item):
+                return False
+        return True
+
+    # with an equality among the conditions, ranges are checked on the few rows it finds instead of being collected
+    looked_up = [condition for condition in conditions if condition.exact] or [
+        condition for condition in conditions if condition.lookup is not None]
+    residual = [condition.predicate for condition in conditions if condition not in looked_up]
+
+    def lookup():
+        data_ids = sorted((set(condition.lookup()) for condition in looked_up), key=len)
+        data_ids = data_ids[0].intersection(*data_ids[1:])
+        if residual:
+            data_ids = {data_id for data_id in data_ids if all(check(table.data[data_id]) for check in residual)}
+        return data_ids
+
+    return Condition(predicate, lookup if looked_up else None, any(condition.exact for condition in conditions))
+
+
+def condition_field(table, name):
+    try:
+        return table.fields[name]
+    except KeyError:
+        raise RuntimeError(f'Table {table.name} does not have field {name}')
+
+
+def compile_comparison(table, comparison, parameters=()):
+    field = condition_field(table, comparison.field)
+    name = field.name
+    offset = table.columns[name]
+    value = bind(field, comparison.value, parameters)
+    if comparison.operator == '==':
+        if name == table.id_key or name in table.indexes:
+            return Condition(lambda item: item[offset] == value, lambda: table.lookup(name, value), True)
+        return Condition(lambda item: item[offset] == value)
+    elif comparison.operator == '!=':
+        return Condition(lambda item: item[offset] != value)
+    elif comparison.operator == '<':
+        return compile_range(table, field, high=value, include_high=False)
+    elif comparison.operator == '<=':
+        return compile_range(table, field, high=value)
+    elif comparison.operator == '>':
+        return compile_range(table, field, low=value, include_low=False)
+    elif comparison.operator == '>=':
+        return compile_range(table, field, low=value)
+    raise RuntimeError(f'Operand not supported: {comparison.operator}')
+
+
+def compile_range(table, field, low=None, high=None, include_low=True, include_high=True):
+    """Bounds of a range comparison or BETWEEN, a None bound is open; answered by a SORTED index when there is one."""
+    name = field.name
+    offset = table.columns[name]
+
+    def predicate(item):
+        value = item[offset]
+        if low is not None and (value < low or (value == low and not include_low)):
+            return False
+        if high is not None and (value > high or (value == high and not include_high)):
+            return False
+        return True
+
+    if not isinstance(table.indexes.get(name), SortedIndex):
+        return Condition(predicate)
+
+    def lookup():
+        return table.indexes[name].range(low, high, include_low, include_high)
+
+    return Condition(predicate, lookup)
+
+
+ARITHMETIC_OPERATORS = {
+    '+': lambda left, right: left + right,
+    '-': lambda left, right: left - right,
+    '*': lambda left, right: left * right,
+    '/': lambda left, right: left // right if isinstance(left, int) and isinstance(right, int) else left / right,
+}
+
+
+def compile_assignments(table, assignments, parameters=()):
+    """(offset, field, expression) of every SET assignment, `expression` computes the new value from the old row."""
+    compiled = []
+    for assignment in assignments:
+        try:
+            field = table.fields[assignment.column]
+        except KeyError:
+            raise RuntimeError(f'Table {table.name} does not have field {assignment.column}')
+        if field.name == table.id_key:
+            raise RuntimeError(f'Field {field.name} of table {table.name} can not be updated')
+        expression = compile_expression(table, field, assignment.expression, parameters)
+        compiled.append((table.columns[field.name], field, expression))
+    return compiled
+
+
+def compile_expression(table, field, node, parameters=()):
+    """Column references read the row, literals are parsed with the type of the assigned field."""
+    if isinstance(node, BinaryOperation):
+        left = compile_expression(table, field, node.left, parameters)
+        right = compile_expression(table, field, node.right, parameters)
+        operator = ARITHMETIC_OPERATORS[node.operator]
+
+        def expression(item):
             try:
-                value = table.fields[field].parse(value)
-                if operand == '==':
-                    return [item for item in data if item[field] == value]
-                else:
-                    return [item for item in data if item[field] != value]
-            except KeyError:
-                raise RuntimeError(f'Table {table.name} does not have field {field}')
+                return operator(left(item), right(item))
+            except (TypeError, ZeroDivisionError) as e:
+                raise RuntimeError(f'Can not compute {node.operator} for field {field.name}: {e}')
+
+        return expression
+    if isinstance(node, Name) and node.name.lower() in table.columns:
+        offset = table.columns[node.name.lower()]
+        return lambda item: item[offset]
+    value = bind(field, node.name if isinstance(node, Name) else node.value, parameters)
+    return lambda item: value
+
+
+def iter_condition(table, condition):
+    """Rows matching a compiled WHERE clause, produced one at a time; every row read is counted as scanned."""
+    scanned = 0
+    try:
+        if condition is None:
+            for item in table.data.values():
+                scanned += 1
+                yield item
+        elif condition.lookup is not None:
+            for data_id in sorted(condition.lookup()):
+                scanned += 1
+                yield table.data[data_id]
         else:
-            raise RuntimeError(f'Error after {condition}')
+            predicate = condition.predicate
+            for item in table.data.values():
+                scanned += 1
+                if predicate(item):
+                    yield item
+    finally:
+        table.metrics.count('rows_scanned', table.name, scanned)
+
+
+def parse_condition(table, condition):
+    with table.metrics.timer('parse_condition', table.name):
+        return list(iter_condition(table, condition))
+
+
+def compile_order(table, order_by):
+    return [(condition_field(table, name).name, descending) for name, descending in order_by]
+
+
+def iter_ordered(table, condition, order, count=None):
+    """Rows matching `condition` in ORDER BY order, when `count` is given only that many rows are needed.
+
+    A single key with a SORTED index is read in index order and stops as soon as the caller does, otherwise the
+    matches are sorted, keeping only the first `count` with a heap.
+    """
+    if len(order) == 1 and (condition is None or condition.lookup is None):
+        name, descending = order[0]
+        index = table.indexes.get(name)
+        if isinstance(index, SortedIndex):
+            predicate = condition.predicate if condition is not None else None
+            scanned = 0
+            try:
+                for value, item_id in (reversed(index) if descending else iter(index)):
+                    scanned += 1
+                    item = table.data[item_id]
+                    if predicate is None or predicate(item):
+                        yield item
+            finally:
+                table.metrics.count('rows_scanned', table.name, scanned)
+            return
+    items = iter_condition(table, condition)
+    if count is not None and len({descending for name, descending in order}) == 1:
+        key = itemgetter(*[table.columns[name] for name, descending in order])
+        yield from (heapq.nlargest if order[0][1] else heapq.nsmallest)(count, items, key=key)
+        return
+    items = list(items)
+    for name, descending in reversed(order):
+        items.sort(key=itemgetter(table.columns[name]), reverse=descending)
+    yield from items
+
+
+def select_items(plan):
+    stop = None if plan.limit is None else plan.offset + plan.limit
+    if plan.order:
+        items = iter_ordered(plan.table, plan.condition, plan.order, stop)
+    else:
+        items = iter_condition(plan.table, plan.condition)
+    return islice(items, plan.offset, stop)
+
+
+def compile_scalar(table, column):
+    """The value of a plain SELECT or GROUP BY item from a row, `date(field)` keeps the date part of a timestamp."""
+    offset = table.columns[condition_field(table, column.field).name]
+    if column.function is not None and column.function != 'date':
+        raise RuntimeError(f'Function {column.function} can not be used here')
+    transform = scalar_function(column.function)
+    return lambda item: transform(item[offset])
+
+
+def scalar_function(function):
+    if function == 'date':
+        return lambda value: str(value)[:10]
+    return lambda value: value
+
+
+def compile_projection(table, statement):
+    if statement.group_by or any(column.function in AGGREGATES for column in statement.columns):
+        return Aggregation(table, statement)
+    return Projection(table, statement.columns)
+
+
+class Projection:
+    """A SELECT list without aggregates, the listed values of every selected row."""
+
+    def __init__(self, table, columns):
+        self.columns = {column.label: offset for offset, column in enumerate(columns)}
+        self.getters = [compile_scalar(table, column) for column in columns]
+
+    def rows(self, plan):
+        getters = self.getters
+        return (tuple(getter(item) for getter in getters) for item in select_items(plan))
+
+
+AGGREGATE_STEPS = {
+    'count': lambda state, value: state + 1,
+    'sum': lambda state, value: state + value,
+    'min': lambda state, value: value if state is None or value < state else state,
+    'max': lambda state, value: value if state is None or value > state else state,
+}
+AGGREGATE_INITIAL = {'count': 0, 'sum': 0, 'min': None, 'max': None}
+
+
+class Aggregation:
+    """A SELECT list with aggregates or a GROUP BY, computed from the column values of the matching rows.
+
+    Without a WHERE clause the columns are read with `data.column`, so a binary table is aggregated without decoding
+    its rows. ORDER BY, LIMIT and OFFSET apply to the result rows and ORDER BY refers to their labels.
+    """
+
+    def __init__(self, table, statement):
+        self.table = table
+        self.statement = statement
+        self.columns = {column.label: offset for offset, column in enumerate(statement.columns)}
+        for column in statement.group_by:
+            compile_scalar(table, column)
+        self.keys = [(condition_field(table, column.field).name, column.function) for column in statement.group_by]
+        group_by = [(column.function, column.field) for column in statement.group_by]
+        self.names = []
+        self.aggregates = []
+        self.outputs = []
+        for column in statement.columns:
+            if column.function in AGGREGATES:
+                name = None if column.field is None else condition_field(table, column.field).name
+                if name is not None and name not in self.names:
+                    self.names.append(name)
+                self.outputs.append((False, len(self.aggregates)))
+                self.aggregates.append((column.function, name))
+            elif (column.function, column.field) in group_by:
+                self.outputs.append((True, group_by.index((column.function, column.field))))
+            else:
+                raise RuntimeError(f'{column.label} must be an aggregate or appear in GROUP BY')
+        for name, function in self.keys:
+            if name not in self.names:
+                self.names.append(name)
+        for name, descending in statement.order_by:
+            if name not in self.columns:
+                raise RuntimeError(f'ORDER BY {name} is not a column of the result')
+
+    def values(self, condition):
+        """Tuples of the `names` columns of the matching rows."""
+        table = self.table
+        if condition is None:
+            table.metrics.count('rows_scanned', table.name, len(table.data))
+            return zip(*[(value for item_id, value in table.data.column(name)) for name in self.names])
+        offsets = [table.columns[name] for name in self.names]
+        return (tuple(item[offset] for offset in offsets) for item in iter_condition(table, condition))
 
-    def evaluate_operator(data1, data2, operand):
-        if operand == 'OR':
-            return list({v['id']: v for v in data1 + data2}.values())
+    def total(self, condition):
+        """The single result row of an aggregation without GROUP BY."""
+        table = self.table
+        if condition is None:
+            count = len(table.data)
+            if any(name is not None for function, name in self.aggregates):
+                table.metrics.count('rows_scanned', table.name, count)
+        elif condition.lookup is not None and all(name is None for function, name in self.aggregates):
+            count = len(condition.lookup())
         else:
-            return [item for item in data1 if item in data2]
+            items = parse_condition(table, condition)
+            count = len(items)
+        result = []
+        for function, name in self.aggregates:
+            if function == 'count':
+                result.append(count)
+                continue
+            index = table.indexes.get(name)
+            if condition is None and function in ['min', 'max'] and isinstance(index, SortedIndex):
+                entry = next(iter(index) if function == 'min' else reversed(index), None)
+                result.append(entry[0] if entry is not None else None)
+                continue
+            if condition is None:
+                column = (value for item_id, value in table.data.column(name))
+            else:
+                offset = table.columns[name]
+                column = (item[offset] for item in items)
+            if function == 'sum':
+                result.append(sum(column))
+            else:
+                result.append((min if function == 'min' else max)(column, default=None))
+        return [tuple(result[index] for is_key, index in self.outputs)]
+
+    def groups(self, condition):
+        positions = {name: position for position, name in enumerate(self.names)}
+        keys = [(positions[name], scalar_function(function)) for name, function in self.keys]
+        aggregates = [(AGGREGATE_STEPS[function], None if name is None else positions[name])
+                      for function, name in self.aggregates]
+        initial = [AGGREGATE_INITIAL[function] for function, name in self.aggregates]
+        groups = {}
+        for values in self.values(condition):
+            group = tuple(key(values[position]) for position, key in keys)
+            states = groups.get(group)
+            if states is None:
+                states = groups[group] = list(initial)
+            for index, (step, position) in enumerate(aggregates):
+                states[index] = step(states[index], None if position is None else values[position])
+        return [
+            tuple(group[index] if is_key else states[index] for is_key, index in self.outputs)
+            for group, states in sorted(groups.items())
+        ]
+
+    def rows(self, plan):
+        statement = self.statement
+        items = self.groups(plan.condition) if self.keys else self.total(plan.condition)
+        for name, descending in reversed(statement.order_by):
+            items.sort(key=itemgetter(self.columns[name]), reverse=descending)
+        stop = None if plan.limit is None else plan.offset + plan.limit
+        return islice(items, plan.offset, stop)
+
+
+class Row(Mapping):
+    """Mapping view of a row tuple through the column offsets shared by its table.
+
+    Assigning a column replaces the tuple held by the view, the row stored in the table is never modified.
+    """
+    __slots__ = ('columns', 'item')
+
+    def __init__(self, columns, item):
+        self.columns = columns
+        self.item = item
+
+    def __getitem__(self, key):
+        return self.item[self.columns[key]]
+
+    def __setitem__(self, key, value):
+        item = list(self.item)
+        item[self.columns[key]] = value
+        self.item = tuple(item)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Plan:
+    """A statement compiled against its table, with the values of its parameters bound."""
 
-    current_data = table.data.values()
-    if condition_str:
-        conditions = re.split('\s+and|or\s+', condition_str, re.IGNORECASE)
-        data_items = [evaluate_simple_condition(current_data, condition) for condition in conditions]
-        operators = ['and'] + re.findall('\s+(and|or)\s+', condition_str, re.IGNORECASE)
-        while data_items:
-            data_item = data_items.pop(0)
-            operator = operators.pop(0).upper()
-            current_data = evaluate_operator(current_data, data_item, operator)
+    def __init__(self, statement, table, condition=None, assignments=None, order=None, projection=None):
+        self.statement = statement
+        self.table = table
+        self.condition = condition
+        self.assignments = assignments
+        self.order = order
+        self.projection = projection
+        self.rows = None
+        self.values = None
+        self.limit = None
+        self.offset = 0
+        self.cache_key = None
+        self.query = None
+        self.parameters = ()
 
-    return current_data
+
+class PreparedStatement:
+    """A query parsed once, executed with the values bound to its `?` placeholders.
+
+    Parameters are python values converted to the type of the column they are compared with or assigned to, so they
+    never go through query text and need no quoting.
+    """
+
+    def __init__(self, database, query):
+        parser = Parser(query)
+        self.database = database
+        self.query = query
+        self.statement = parser.parse()
+        self.parameter_count = parser.parameters
+        self.plan = None
+
+    def bind(self, *parameters):
+        if len(parameters) != self.parameter_count:
+            raise RuntimeError(f'`{self.query}` takes {self.parameter_count} parameters, {len(parameters)} given')
+        if self.parameter_count == 0:
+            if self.plan is None:
+                self.plan = self.database.compile(self.statement)
+                self.plan.cache_key = (self.query, ())
+                self.plan.query = self.query
+            return self.plan
+        plan = self.database.compile(self.statement, parameters)
+        plan.query = self.query
+        plan.parameters = parameters
+        try:
+            hash(parameters)
+            plan.cache_key = (self.query, parameters)
+        except TypeError:
+            pass
+        return plan
+
+    def execute(self, *parameters):
+        return self.database.execute(self.bind(*parameters))
+
+    def iter(self, *parameters):
+        return self.database.iter_plan(self.bind(*parameters))
 
 
 class Database:
-    def __init__(self, schema_file='schema.txt', storage_path='db'):
+    def __init__(self, schema_file='schema.txt', storage_path='db', plan_cache_size=256, result_cache_size=0,
+                 slow_query_log=None, slow_query_ms=100, load_workers=0, durability=Durability.SYNC,
+                 group_commit_ms=5, group_commit_records=1000):
         self.schema = {}
         self.storage_path = storage_path
+        self.statement_cache = PlanCache(plan_cache_size)
+        self.result_cache = ResultCache(result_cache_size) if result_cache_size else None
+        self.metrics = Metrics(slow_query_log, slow_query_ms)
+        self.durability = check_durability(durability)
+        self.journal = Journal(os.path.join(storage_path, 'database.journal'), self.metrics, group_commit_ms,
+                               group_commit_records)
+        self.local = threading.local()
+        self.journal.recover(storage_path)
         self.read_schema(schema_file)
+        if load_workers:
+            self.load_tables(load_workers)
         print(f"Database initialized successfully.")
 
     def read_schema(self, schema_file: str):
         table = None
+        storage = 'csv'
         fields = []
         mode = 'r'
         if not os.path.exists(schema_file):
@@ -58,138 +558,604 @@ class Database:
             for line in f:
                 line = line.lower().strip()
                 if not line:
-                    self.add_table(table, fields)
+                    self.add_table(table, fields, storage)
                     table = None
                     fields = []
-                elif match := re.search('^(.\w*)$', line):
+                elif table is None:
+                    if not (match := re.search(f'^(\\w+)(?:\\s+({"|".join(STORAGE_ENGINES)}))?$', line)):
+                        raise RuntimeError(f"Invalid table definition `{line}`")
                     table = match.group(1)
+                    storage = match.group(2) or 'csv'
                 elif match := re.search('^(.\w*)(.*)$', line):
                     field_name = match.group(1)
                     field_type = match.group(2)
                     fields.append(Field(field_name, field_type))
 
         if table is not None:
-            self.add_table(table, fields)
+            self.add_table(table, fields, storage)
 
-    def add_table(self, table, fields):
+    def add_table(self, table, fields, storage='csv'):
         if not fields:
             raise RuntimeError(f"Table {table} should have at least one field")
-        table_path = os.path.join(self.storage_path, f'{table}.db')
-        table = Table(table_path, fields)
+        engine = STORAGE_ENGINES[storage]
+        table_path = os.path.join(self.storage_path, f'{table}.{engine.extension}')
+        table = Table(table_path, fields, engine, self.metrics)
         if table.name in self.schema:
             raise RuntimeError(f"Table {table.name} already exists.")
         self.schema[table.name] = table
 
-    def run_query(self, query: str):
+    def prepare(self, query: str):
+        """Parse a query with `?` placeholders once, the statement is shared by every caller preparing the same text."""
         query = query.strip()
-        if match := re.search('^select from (\w*)(?: where )?(.*);$', query, re.IGNORECASE):
-            table_name = match.group(1)
-            condition = match.group(2).strip()
-            return self.__select(table_name, condition)
-        elif match := re.search('^insert into (\w*) \s*\((([^\)]+))\)\s*values\s*\((([^\)]+))\);$', query,
-                                re.IGNORECASE):
-            table_name = match.group(1)
-            columns = [item.strip() for item in match.group(2).strip().split(',')]
-            values = [item.strip() for item in match.group(4).strip().split(',')]
-            return self.__insert(table_name, values, columns)
-        elif match := re.search('^insert into (\w*) values\s*\((([^\)]+))\);$', query,
-                                re.IGNORECASE):
-            table_name = match.group(1)
-            values = [item.strip() for item in match.group(2).strip().split(',')]
-            return self.__insert(table_name, values)
-        elif match := re.search('^update (\w*) \s*(?:where)\s*(.*);$', query, re.IGNORECASE):
-            table_name = match.group(1)
-            condition, values = match.group(2).strip().split(' values ')
-            values = [item.strip() for item in values.replace(')', '').replace('(', '').split(',')]
-            return self.__update(table_name, condition, values)
-        elif match := re.search('^delete from (\w*)(?: where )?(.*);$', query, re.IGNORECASE):
-            table_name = match.group(1)
-            condition = match.group(2).strip()
-            self.__delete(table_name, condition)
+        statement = self.statement_cache.get(query)
+        if statement is None:
+            statement = PreparedStatement(self, query)
+            self.statement_cache.put(query, statement)
+        return statement
+
+    def plan(self, query: str):
+        return self.prepare(query).bind()
+
+    def compile(self, statement, parameters=()):
+        table = self.get_table(statement.table) if hasattr(statement, 'table') else None
+        condition = None
+        if getattr(statement, 'where', None) is not None:
+            condition = compile_condition(table, statement.where, parameters)
+        assignments = None
+        if getattr(statement, 'assignments', None) is not None:
+            assignments = compile_assignments(table, statement.assignments, parameters)
+        projection = None
+        if isinstance(statement, Select) and statement.columns:
+            projection = compile_projection(table, statement)
+        order = None
+        if getattr(statement, 'order_by', None) and not isinstance(projection, Aggregation):
+            order = compile_order(table, statement.order_by)
+        plan = Plan(statement, table, condition, assignments, order, projection)
+        if isinstance(statement, Insert):
+            plan.rows = [bind_values(values, parameters) for values in statement.rows]
+        elif isinstance(statement, Update) and statement.values is not None:
+            plan.values = bind_values(statement.values, parameters)
+        elif isinstance(statement, Select):
+            plan.limit, plan.offset = bind_values([statement.limit, statement.offset], parameters)
+            if plan.limit is not None:
+                plan.limit = int(plan.limit)
+            plan.offset = int(plan.offset)
+        return plan
+
+    def run_query(self, query: str):
+        return self.execute(self.plan(query))
+
+    def execute(self, plan):
+        """Run a compiled statement, its latency is recorded per statement type and table."""
+        started = time.perf_counter()
+        try:
+            return self.__execute(plan)
+        finally:
+            milliseconds = (time.perf_counter() - started) * 1000
+            table_name = plan.table.name if plan.table is not None else '-'
+            self.metrics.observe(type(plan.statement).__name__.lower(), table_name, milliseconds)
+            self.metrics.query(plan.query, plan.parameters, milliseconds)
+
+    def __execute(self, plan):
+        statement = plan.statement
+        if isinstance(statement, Select):
+            return list(self.__iter_select(plan))
+        elif isinstance(statement, Insert):
+            with self.__autocommit():
+                rows = self.__insert(plan.table, plan.rows, statement.columns)
+            return rows[0] if len(rows) == 1 else rows
+        elif isinstance(statement, Update):
+            with self.__autocommit():
+                if plan.assignments is not None:
+                    return self.__patch(plan.table, plan.condition, plan.assignments)
+                return self.__update(plan.table, plan.condition, plan.values)
+        elif isinstance(statement, Delete):
+            with self.__autocommit():
+                self.__delete(plan.table, plan.condition)
+        elif isinstance(statement, Begin):
+            self.begin()
+        elif isinstance(statement, Commit):
+            self.commit()
+        elif isinstance(statement, Rollback):
+            self.rollback()
+
+    @property
+    def current_transaction(self):
+        """The transaction of the calling thread, every thread runs its own."""
+        return getattr(self.local, 'transaction', None)
+
+    @current_transaction.setter
+    def current_transaction(self, transaction):
+        self.local.transaction = transaction
+
+    def begin(self, durability=None):
+        """Start a transaction of this thread, `durability` overrides the durability of the database for it."""
+        if self.current_transaction is not None:
+            raise RuntimeError('A transaction is already in progress.')
+        self.current_transaction = Transaction(check_durability(durability) if durability else self.durability)
+
+    def commit(self):
+        """Persist the transaction; if that fails its changes are undone like on a rollback and the error raised."""
+        transaction = self.__end_transaction()
+        try:
+            commit = self.journal.commit(transaction, transaction.durability)
+        except BaseException:
+            self.__undo(transaction)
+            raise
+        finally:
+            transaction.release()
+        # the locks are released first, so other transactions can join the group waiting for the same fsync
+        if transaction.durability == Durability.GROUP:
+            self.journal.wait(commit)
+
+    def rollback(self):
+        transaction = self.__end_transaction()
+        try:
+            self.__undo(transaction)
+        finally:
+            transaction.release()
+
+    def __undo(self, transaction):
+        for table, operation, item in reversed(transaction.undo):
+            self.__invalidate(table)
+            with table.mutex:
+                table.undo(operation, item)
+
+    def __end_transaction(self):
+        if self.current_transaction is None:
+            raise RuntimeError('No transaction in progress.')
+        transaction = self.current_transaction
+        self.current_transaction = None
+        return transaction
+
+    @contextmanager
+    def transaction(self, durability=None):
+        """Run the enclosed queries atomically, they are persisted with a single journal write on success."""
+        self.begin(durability)
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
         else:
-            raise RuntimeError(f"Invalid query `{query}`")
+            self.commit()
+
+    @contextmanager
+    def __autocommit(self):
+        if self.current_transaction is not None:
+            yield
+        else:
+            with self.transaction():
+                yield
 
     def get_table(self, table_name):
         try:
-            return self.schema[table_name]
+            table = self.schema[table_name]
         except KeyError:
             raise RuntimeError(f'Table {table_name} does not exists.')
+        if not table.loaded:
+            with table.lock.write():
+                table.load()
+        return table
 
-    def __select(self, table_name, condition):
-        table = self.get_table(table_name)
-        data = parse_condition(table, condition)
-        return data
+    def load_tables(self, workers=None, chunk_bytes=LOAD_CHUNK_BYTES):
+        """Read every table not loaded yet, the files are split in chunks decoded in parallel by `workers` processes."""
+        tables = [table for table in self.schema.values() if not table.loaded]
+        with ProcessPoolExecutor(workers) as executor:
+            reads = [(table, table.storage.read_parallel(executor, chunk_bytes)) for table in tables]
+            for table, read in reads:
+                with table.lock.write():
+                    table.load(read)
+
+    def iter_query(self, query: str):
+        """Rows of a SELECT produced lazily, rows are only read and filtered as far as the caller iterates."""
+        return self.iter_plan(self.plan(query))
+
+    def iter_plan(self, plan):
+        if not isinstance(plan.statement, Select):
+            raise RuntimeError('Only SELECT queries can be iterated.')
+        if plan.order or plan.projection is not None or (self.result_cache is not None and plan.cache_key is not None):
+            return self.__iter_select(plan)
+        return self.__stream_select(plan)
+
+    def __stream_select(self, plan):
+        """Rows of a SELECT without ORDER BY or aggregates, read in batches of `STREAM_BATCH_ROWS`.
+
+        Only the ids of the candidate rows are collected up front. Every batch is read under the read lock of the
+        table, so writes go on between batches and a row is returned as it was committed when its batch was read.
+        """
+        table = plan.table
+        condition = plan.condition
+        with table.lock.read():
+            data_ids = sorted(condition.lookup()) if condition is not None and condition.lookup else list(table.data)
+        predicate = condition.predicate if condition is not None else None
+
+        def items():
+            scanned = 0
+            try:
+                for start in range(0, len(data_ids), STREAM_BATCH_ROWS):
+                    batch = []
+                    with table.lock.read():
+                        for data_id in data_ids[start:start + STREAM_BATCH_ROWS]:
+                            scanned += 1
+                            item = table.data.get(data_id)
+                            if item is not None and (predicate is None or predicate(item)):
+                                batch.append(item)
+                    yield from batch
+            finally:
+                table.metrics.count('rows_scanned', table.name, scanned)
+
+        stop = None if plan.limit is None else plan.offset + plan.limit
+        return self.__rows(table, table.columns, islice(items(), plan.offset, stop))
+
+    def __iter_select(self, plan):
+        """Rows of a SELECT, from the result cache when it is enabled.
 
-    def __insert(self, table_name, values, columns=[]):
+        The matching row tuples are collected under the read lock of the table, so selects on a table run in parallel
+        and never see a write half applied; the lock is not held while the caller iterates.
+        """
+        cache = self.result_cache
+        with plan.table.lock.read():
+            if cache is not None and plan.cache_key is not None:
+                result = cache.get(plan.cache_key)
+                if result is None:
+                    columns, items = self.__select_items(plan)
+                    result = (columns, list(items))
+                    cache.put(plan.table.name, plan.cache_key, result)
+                columns, items = result
+            else:
+                columns, items = self.__select_items(plan)
+                items = list(items)
+        return self.__rows(plan.table, columns, items)
+
+    def __rows(self, table, columns, items):
+        returned = 0
+        try:
+            for item in items:
+                returned += 1
+                yield Row(columns, item)
+        finally:
+            self.metrics.count('rows_returned', table.name, returned)
+
+    @staticmethod
+    def __select_items(plan):
+        if plan.projection is not None:
+            return plan.projection.columns, plan.projection.rows(plan)
+        return plan.table.columns, select_items(plan)
+
+    def __invalidate(self, table):
+        if self.result_cache is not None:
+            self.result_cache.invalidate(table.name)
+
+    def insert_many(self, table_name, rows):
+        """Insert dicts of column values with one uniqueness pass, one id allocation and one commit."""
         table = self.get_table(table_name)
+        rows = list(rows)
+        if not rows:
+            return []
+        columns = list(rows[0].keys())
+        try:
+            values = [[row[column] for column in columns] for row in rows]
+        except KeyError as e:
+            raise RuntimeError(f'Row without column {e} inserted in {table_name}.')
+        with self.metrics.timer('insert', table_name), self.__autocommit():
+            return self.__insert(table, values, columns)
+
+    def __lock(self, table, mode=LockMode.WRITE):
+        """Hold a lock of `table` until the transaction of this thread ends."""
+        transaction = self.current_transaction
+        if (table, LockMode.WRITE) in transaction.locks or (table, mode) in transaction.locks:
+            return
+        if mode == LockMode.WRITE:
+            table.lock.acquire_write()
+        else:
+            table.lock.acquire_intent()
+        transaction.locks.append((table, mode))
+
+    def __lock_rows(self, table, data_ids):
+        acquired = table.lock.acquire_rows(data_ids)
+        self.current_transaction.rows.append((table, acquired))
+
+    def __rows_for_write(self, table, condition):
+        """Lock what writing the rows matching `condition` needs, and return those rows.
+
+        A WHERE clause answered by the indexes only locks the matching rows, so writes to different rows of a table
+        run in parallel; any other write locks the whole table.
+        """
+        if condition is None or condition.lookup is None:
+            self.__lock(table)
+            self.__invalidate(table)
+            return parse_condition(table, condition)
+        self.__lock(table, LockMode.INTENT)
+        self.__invalidate(table)
+        with table.mutex:
+            data_ids = sorted(condition.lookup())
+        self.__lock_rows(table, data_ids)
+        data_ids = set(data_ids)
+        # the rows may have changed while waiting for their locks, so the clause is evaluated again
+        with table.mutex:
+            return [item for item in parse_condition(table, condition) if item[table.id_offset] in data_ids]
+
+    def __insert(self, table, rows, columns=None):
+        self.__lock(table, LockMode.INTENT)
+        self.__invalidate(table)
         if not columns:
             columns = table.fields.keys()
-        if len(columns) != len(values):
-            raise RuntimeError(f'Inserted {len(values)} values in {len(columns)} columns.')
+        for values in rows:
+            if len(columns) != len(values):
+                raise RuntimeError(f'Inserted {len(values)} values in {len(columns)} columns.')
 
-        return table.insert(columns, values)
+        with table.mutex:
+            items = table.insert_many(columns, rows, self.current_transaction)
+            self.__lock_rows(table, [item[table.id_offset] for item in items])
+        return [Row(table.columns, item) for item in items]
 
-    def __update(self, table_name, condition, values):
-        table = self.get_table(table_name)
-        data = self.__select(table_name, condition)
+    def __update(self, table, condition, values):
+        data = self.__rows_for_write(table, condition)
         columns = table.fields.keys()
         if len(columns) != len(values):
             raise RuntimeError(f'Updated {len(values)} values in {len(columns)} columns.')
 
-        table.update(data, values)
+        with table.mutex:
+            table.update(data, values, self.current_transaction)
         return len(data)
 
-    def __delete(self, table_name, condition):
+    def __patch(self, table, condition, assignments):
+        data = self.__rows_for_write(table, condition)
+        with table.mutex:
+            table.patch(data, assignments, self.current_transaction)
+        return len(data)
+
+    def __delete(self, table, condition):
+        self.__lock(table)
+        self.__invalidate(table)
+        data = parse_condition(table, condition)
+        table.delete([item[table.id_offset] for item in data], self.current_transaction)
+
+    def next_value(self, table_name, field_name, step=1):
         table = self.get_table(table_name)
-        data = self.__select(table_name, condition)
-        data_ids = [item[table.id_key] for item in data]
-        table.data = {id: item for id, item in table.data.items() if id not in data_ids}
-        table.write_data()
+        with table.mutex:
+            return table.next_value(field_name, step)
+
+    def checkpoint(self):
+        with ExitStack() as stack:
+            tables = [table for table in self.schema.values() if table.loaded]
+            for table in tables:
+                stack.enter_context(table.lock.write())
+            self.journal.fsync()
+            for table in tables:
+                table.checkpoint()
+            self.journal.truncate()
+
+    def close(self):
+        self.journal.close()
+        for table in self.schema.values():
+            table.close()
+        self.metrics.close()
 
 
 class Table:
-    def __init__(self, path, fields):
+    def __init__(self, path, fields, storage=CsvStorage, metrics=None):
         self.path = path
+        self.metrics = metrics or Metrics()
+        self.log_path = os.path.splitext(path)[0] + '.log'
+        self.sequence_path = os.path.splitext(path)[0] + '.seq'
         self.name = os.path.split(path)[-1].split('.')[0]
         self.fields = {}
+        self.columns = {}
         self.id_key = 'id'
+        self.id_offset = 0
         self.set_fields(fields)
-        self.data = {}
-        self.read_data()
-        print(f"Reading {self.name}({list(self.fields.keys())}), {len(self.data)} records")
+        self.sequences = {
+            name: Sequence(field.sequence_start) for name, field in self.fields.items()
+            if field.sequence_start is not None
+        }
+        self.storage = storage(path, self.fields, self.id_key)
+        self.data = self.storage.rows()
+        self.indexes = {}
+        self.log_file = None
+        self.log_writer = None
+        self.log_records = 0
+        self.loaded = False
+        self.load_time = None
+        self.lock = TableLock(self.name)
+        self.mutex = threading.RLock()
 
-    def read_data(self):
-        def recreate_db():
-            current_path = ''
-            for path in os.path.split(self.path)[:-1]:
-                current_path = os.path.join(current_path, path)
-                if not os.path.exists(current_path):
-                    os.mkdir(current_path)
+    def load(self, read=None):
+        """Read the table on first use, so startup does not depend on the size of the tables."""
+        if self.loaded:
+            return
+        started = time.perf_counter()
+        self.read_data(read)
+        self.loaded = True
+        self.load_time = time.perf_counter() - started
+        self.metrics.observe('read_data', self.name, self.load_time * 1000)
+        print(f"Reading {self.name}({list(self.fields.keys())}), {len(self.data)} records in {self.load_time:.3f}s")
 
-            writer = csv.writer(open(self.path, 'w+'))
-            writer.writerow(self.fields.keys())
+    def read_data(self, read=None):
+        """Load the snapshot with `read`, the storage reader by default, then apply the log and build the indexes."""
+        persisted = self.read_sequences()
+        self.data = (read or self.storage.read)()
+        # a sequence persisted with the snapshot is already advanced past its rows, the others have to scan them
+        # before the log is replayed, which may delete the row holding the highest value
+        scanned = self.sequences.keys() - persisted
+        for name in scanned:
+            for item_id, value in self.data.column(name):
+                self.sequences[name].advance(int(value))
+        torn = self.replay_log()
+        if scanned:
+            self.write_sequences()
+        if torn or self.log_records >= max(LOG_CHECKPOINT_RECORDS, len(self.data)):
+            self.checkpoint()
+        self.build_indexes()
 
-        if not os.path.exists(self.path):
-            recreate_db()
-        else:
-            with open(self.path, 'r') as f:
-                data = csv.DictReader(f)
-                if set(data.fieldnames) != self.fields.keys():
-                    recreate_db()
-                for no, item in enumerate(data):
-                    item_id = int(item[self.id_key])
-                    if item_id in self.data:
-                        raise RuntimeError(f"Duplicate id {item_id} in {self.name}")
-                    for key, field in self.fields.items():
-                        item[key] = field.parse(item[key])
-                    self.data[item_id] = item
+    def replay_log(self):
+        """Apply the write-ahead log on top of the snapshot, returns True if the log ends with a torn record."""
+        if not os.path.exists(self.log_path):
+            return False
+        torn = False
+        fields = list(self.fields.values())
+        stored = [field for field in fields if field.default is None]
+
+        def complete_lines(f):
+            nonlocal torn
+            for line in f:
+                if not line.endswith('\n'):
+                    torn = True
+                    break
+                yield line
+
+        with open(self.log_path, 'r', newline='') as f:
+            for record in csv.reader(complete_lines(f)):
+                self.log_records += 1
+                operation, values = record[0], record[1:]
+                if operation in [LogOperation.INSERT, LogOperation.UPDATE] and len(values) == len(stored) < len(fields):
+                    # written before the fields with a default were added to the schema
+                    values = iter(values)
+                    values = [str(field.default) if field.default is not None else next(values) for field in fields]
+                if operation == LogOperation.DELETE and len(values) == 1:
+                    self.data.pop(int(values[0]), None)
+                elif operation == LogOperation.PATCH and len(values) % 2 == 1:
+                    self.replay_patch(values)
+                elif operation in [LogOperation.INSERT, LogOperation.UPDATE] and len(values) == len(fields):
+                    item = tuple(field.parse(value) for field, value in zip(fields, values))
+                    self.data[item[self.id_offset]] = item
+                    self.advance_sequences(item)
+                else:
+                    raise RuntimeError(f"Invalid log record {record} in {self.log_path}")
+        return torn
+
+    def replay_patch(self, values):
+        item = self.data.get(int(values[0]))
+        if item is None:
+            return
+        item = list(item)
+        for name, value in zip(values[1::2], values[2::2]):
+            if name not in self.fields:
+                raise RuntimeError(f"Invalid log record patch of field {name} in {self.log_path}")
+            item[self.columns[name]] = self.fields[name].parse(value)
+        item = tuple(item)
+        self.data[item[self.id_offset]] = item
+        self.advance_sequences(item)
+
+    def read_sequences(self):
+        """Advance the sequences to the values saved with the snapshot, returns the names of those found."""
+        persisted = set()
+        if not os.path.exists(self.sequence_path):
+            return persisted
+        with open(self.sequence_path, 'r', newline='') as f:
+            for name, value in csv.reader(f):
+                if name in self.sequences:
+                    self.sequences[name].advance(int(value))
+                    persisted.add(name)
+        return persisted
+
+    def write_sequences(self):
+        temp_path = self.sequence_path + '.tmp'
+        with open(temp_path, 'w+', newline='') as f:
+            writer = csv.writer(f)
+            for name, sequence in self.sequences.items():
+                if sequence.value is not None:
+                    writer.writerow([name, sequence.value])
+        os.replace(temp_path, self.sequence_path)
+
+    def advance_sequences(self, item):
+        for name, sequence in self.sequences.items():
+            sequence.advance(int(item[self.columns[name]]))
+
+    def next_value(self, field_name, step=1):
+        try:
+            sequence = self.sequences[field_name]
+        except KeyError:
+            raise RuntimeError(f'Table {self.name} field {field_name} is not a sequence')
+        return self.fields[field_name].parse(str(sequence.next(step)))
+
+    def build_indexes(self):
+        self.indexes = {}
+        for name, field in self.fields.items():
+            if name == self.id_key:
+                continue
+            if field.is_sorted:
+                self.indexes[name] = SortedIndex(name)
+            elif field.is_unique:
+                self.indexes[name] = UniqueIndex(name)
+            elif field.is_indexed:
+                self.indexes[name] = HashIndex(name)
+        for index in self.indexes.values():
+            index.build(self.data.column(index.field_name))
+
+    def index_add(self, item):
+        for index in self.indexes.values():
+            index.add(item[self.columns[index.field_name]], item[self.id_offset])
+
+    def index_remove(self, item):
+        for index in self.indexes.values():
+            index.remove(item[self.columns[index.field_name]], item[self.id_offset])
+
+    def lookup(self, field_name, value):
+        """Ids of the rows where `field_name` equals `value`, or None when the field is not indexed."""
+        if field_name == self.id_key:
+            return [value] if value in self.data else []
+        if field_name in self.indexes:
+            return self.indexes[field_name].lookup(value)
+        return None
+
+    def is_duplicate(self, field_name, value, item_id=None):
+        return any(data_id != item_id for data_id in self.lookup(field_name, value))
 
     def write_data(self):
-        with open(self.path, 'w+', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=list(self.fields.keys()))
-            writer.writeheader()
-            for item in self.data.values():
-                writer.writerow(item)
+        with self.metrics.timer('write_data', self.name):
+            self.data = self.storage.write(self.data)
+        self.metrics.count('bytes_written', self.name, os.path.getsize(self.path))
+        self.metrics.count('fsyncs', self.name)
+
+    def serialize(self, operation, item):
+        if operation == LogOperation.DELETE:
+            return [operation, item[self.id_offset]]
+        return [operation, *item]
+
+    def log(self, operation, items, transaction=None):
+        self.append_log([self.serialize(operation, item) for item in items], transaction)
+
+    def append_log(self, records, transaction=None):
+        if transaction is None:
+            self.write_log(records)
+        else:
+            transaction.records.extend((self, record) for record in records)
+
+    def write_log(self, records):
+        if self.log_file is None:
+            self.log_file = open(self.log_path, 'a', newline='')
+            self.log_writer = csv.writer(self.log_file)
+        position = self.log_file.tell()
+        self.log_writer.writerows(records)
+        self.log_file.flush()
+        self.log_records += len(records)
+        self.metrics.count('bytes_written', self.name, self.log_file.tell() - position)
+
+    def sync_log(self):
+        if self.log_file is not None:
+            self.log_file.flush()
+            os.fsync(self.log_file.fileno())
+            self.metrics.count('fsyncs', self.name)
+
+    def checkpoint(self):
+        """Fold the write-ahead log into the snapshot file and start a new, empty log."""
+        self.write_sequences()
+        self.write_data()
+        self.close_log()
+        open(self.log_path, 'w').close()
+        self.log_records = 0
+
+    def close_log(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+            self.log_writer = None
+
+    def close(self):
+        self.close_log()
+        self.storage.close()
 
     def set_fields(self, fields):
         id_count = 0
@@ -201,48 +1167,666 @@ class Table:
             raise RuntimeError(f"At least one id column should exists")
         if id_count > 1:
             raise RuntimeError(f"Only one id column should exists")
+        versions = [field.name for field in fields if field.type == DataType.VERSION]
+        if len(versions) > 1:
+            raise RuntimeError("Only one version column should exists")
         self.fields = {field.name: field for field in fields}
+        self.columns = {name: offset for offset, name in enumerate(self.fields)}
+        self.id_offset = self.columns[self.id_key]
+        self.version_key = versions[0] if versions else None
+        self.version_offset = self.columns[self.version_key] if versions else None
 
-    def insert(self, columns, values):
-        data = {column: None for column in columns}
-        values = {column: value for column, value in zip(columns, values)}
+    def insert_many(self, columns, rows, transaction=None):
+        """Parse and validate every row before the first one is stored, then log them in a single write."""
+        positions = {column: position for position, column in enumerate(columns)}
         for field_name, field in self.fields.items():
-            if field_name not in columns:
-                if field_name == self.id_key:
-                    try:
-                        data[field_name] = int(max([item[self.id_key] for item in self.data.values()])) + 1
-                    except:
-                        data[field_name] = 1
+            if field_name not in positions and field_name not in self.sequences and field.default is None:
+                raise ValueError(f"Table {self.name} field {field_name} is not filled.")
+
+        items = []
+        batch_values = {field_name: set() for field_name, field in self.fields.items() if field.is_unique}
+        for values in rows:
+            data = []
+            for field_name, field in self.fields.items():
+                if field_name not in positions:
+                    field_value = field.default if field.default is not None else self.next_value(field_name)
                 else:
-                    raise ValueError(f"Table {self.name} field {field_name} is not filled.")
-            else:
-                field_value = field.parse(values[field_name])
-                if field.is_unique:
-                    exists = [item for item in self.data.values() if item[field_name] == field_value]
-                    if exists:
-                        raise RuntimeError(f'field `{field_name}` duplicate value ({values[field_name]})')
-                data[field_name] = field_value
-
-        self.data[data[self.id_key]] = data
-        self.write_data()
-        return data
+                    field_value = field.coerce(values[positions[field_name]])
+                if field_name in batch_values:
+                    if self.is_duplicate(field_name, field_value) or field_value in batch_values[field_name]:
+                        raise RuntimeError(f'field `{field_name}` duplicate value ({field_value})')
+                    batch_values[field_name].add(field_value)
+                data.append(field_value)
+            item = tuple(data)
+            self.advance_sequences(item)
+            items.append(item)
 
-    def update(self, data, values):
-        data_ids = [item[self.id_key] for item in data]
-        values = {column: value for column, value in zip(self.fields.keys(), values)}
-        for data_idx, data_item in self.data.items():
-            if data_idx not in data_ids:
-                continue
+        for item in items:
+            self.data[item[self.id_offset]] = item
+            self.index_add(item)
+            if transaction is not None:
+                transaction.undo.append((self, LogOperation.INSERT, item))
+        self.log(LogOperation.INSERT, items, transaction)
+        return items
+
+    def update(self, data, values, transaction=None):
+        values = [field.coerce(value) for field, value in zip(self.fields.values(), values)]
+        updated = []
+        for item in list(data):
+            data_idx = item[self.id_offset]
+            values[self.id_offset] = data_idx
+            if self.version_offset is not None:
+                values[self.version_offset] = item[self.version_offset] + 1
             for field_name, field in self.fields.items():
-                field_value = field.parse(values[field_name])
-                if field.is_unique:
-                    exists = [item for item in self.data.values() if item[field_name] == field_value and
-                              data_item[self.id_key] != item[self.id_key]]
-                    if exists:
-                        raise RuntimeError(f'field `{field_name}` duplicate value ({values[field_name]})')
-                self.data[data_idx][field_name] = field_value
+                field_value = values[self.columns[field_name]]
+                if field.is_unique and self.is_duplicate(field_name, field_value, data_idx):
+                    raise RuntimeError(f'field `{field_name}` duplicate value ({field_value})')
+            new_item = tuple(values)
+            self.replace(item, new_item)
+            if transaction is not None:
+                transaction.undo.append((self, LogOperation.UPDATE, item))
+            updated.append(new_item)
+
+        self.log(LogOperation.UPDATE, updated, transaction)
+
+    def patch(self, data, assignments, transaction=None):
+        """Set the assigned columns of every row, only the columns that change are checked, indexed and logged."""
+        records = []
+        for item in list(data):
+            values = list(item)
+            for offset, field, expression in assignments:
+                values[offset] = field.coerce(expression(item))
+            data_idx = item[self.id_offset]
+            changed = [(offset, field) for offset, field, expression in assignments if values[offset] != item[offset]]
+            if not changed:
+                continue
+            if self.version_offset is not None:
+                values[self.version_offset] = item[self.version_offset] + 1
+                changed = [change for change in changed if change[0] != self.version_offset]
+                changed.append((self.version_offset, self.fields[self.version_key]))
+            new_item = tuple(values)
+            for offset, field in changed:
+                if field.is_unique and self.is_duplicate(field.name, new_item[offset], data_idx):
+                    raise RuntimeError(f'field `{field.name}` duplicate value ({new_item[offset]})')
+            self.replace(item, new_item)
+            if transaction is not None:
+                transaction.undo.append((self, LogOperation.UPDATE, item))
+            record = [LogOperation.PATCH, data_idx]
+            for offset, field in changed:
+                record += [field.name, new_item[offset]]
+            records.append(record)
+
+        self.append_log(records, transaction)
+
+    def replace(self, item, new_item):
+        id_offset = self.id_offset
+        for index in self.indexes.values():
+            offset = self.columns[index.field_name]
+            if item[offset] != new_item[offset]:
+                index.remove(item[offset], item[id_offset])
+                index.add(new_item[offset], new_item[id_offset])
+        self.data[new_item[id_offset]] = new_item
+        self.advance_sequences(new_item)
+
+    def delete(self, data_ids, transaction=None):
+        deleted = []
+        for data_id in data_ids:
+            item = self.data.pop(data_id, None)
+            if item is None:
+                continue
+            self.index_remove(item)
+            if transaction is not None:
+                transaction.undo.append((self, LogOperation.DELETE, item))
+            deleted.append(item)
+        self.log(LogOperation.DELETE, deleted, transaction)
+
+    def undo(self, operation, item):
+        data_id = item[self.id_offset]
+        if operation == LogOperation.INSERT:
+            self.index_remove(self.data.pop(data_id))
+        elif operation == LogOperation.UPDATE:
+            self.replace(self.data[data_id], item)
+        elif operation == LogOperation.DELETE:
+            self.data[data_id] = item
+            self.index_add(item)
+
+
+class TableLock:
+    """Locks of a table: shared for readers, intent for writers of single rows and exclusive for other writers.
+
+    Readers share the table with each other and so do row writers, which also lock every row they write, while an
+    exclusive writer has the table to itself; readers and row writers exclude each other, so no one reads a write
+    that is not committed. Waiting exclusive writers go first, then waiting readers. Every lock is reentrant and the
+    thread holding one may take the others for itself. A lock not granted within `timeout` seconds raises, which is
+    how a deadlock between two transactions is broken.
+    """
+
+    def __init__(self, name, timeout=LOCK_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.readers = {}
+        self.intents = {}
+        self.rows = {}
+        self.writer = None
+        self.writes = 0
+        self.waiting_readers = 0
+        self.waiting_writers = 0
+
+    def __wait(self, ready, kind):
+        if not self.condition.wait_for(ready, self.timeout):
+            raise RuntimeError(f'Timed out waiting for the {kind} lock of {self.name}.')
+
+    def __others(self, holders, thread):
+        return bool(holders.keys() - {thread})
+
+    def acquire_read(self):
+        thread = threading.get_ident()
+        with self.condition:
+            if self.writer != thread and thread not in self.readers:
+                self.waiting_readers += 1
+                try:
+                    # a waiting writer waits for the intent lock of this thread, which must not wait for it in turn
+                    self.__wait(lambda: self.writer is None and (not self.waiting_writers or thread in self.intents)
+                                and not self.__others(self.intents, thread), 'read')
+                finally:
+                    self.waiting_readers -= 1
+                    self.condition.notify_all()
+            self.readers[thread] = self.readers.get(thread, 0) + 1
+
+    def acquire_intent(self):
+        thread = threading.get_ident()
+        with self.condition:
+            if self.writer != thread and thread not in self.intents:
+                self.__wait(lambda: self.writer is None and not self.waiting_writers and not self.waiting_readers
+                            and not self.__others(self.readers, thread), 'write')
+            self.intents[thread] = self.intents.get(thread, 0) + 1
+
+    def acquire_write(self):
+        thread = threading.get_ident()
+        with self.condition:
+            if self.writer != thread:
+                self.waiting_writers += 1
+                try:
+                    self.__wait(lambda: self.writer is None and not self.__others(self.readers, thread)
+                                and not self.__others(self.intents, thread), 'write')
+                finally:
+                    self.waiting_writers -= 1
+                    self.condition.notify_all()
+                self.writer = thread
+            self.writes += 1
+
+    def acquire_rows(self, data_ids):
+        """Lock rows for the calling thread, it must hold the intent lock; returns the ids it did not hold yet."""
+        thread = threading.get_ident()
+        with self.condition:
+            self.__wait(lambda: all(self.rows.get(data_id, thread) == thread for data_id in data_ids), 'row')
+            acquired = [data_id for data_id in data_ids if data_id not in self.rows]
+            for data_id in acquired:
+                self.rows[data_id] = thread
+            return acquired
+
+    def release_read(self):
+        self.__release(self.readers)
+
+    def release_intent(self):
+        self.__release(self.intents)
+
+    def __release(self, holders):
+        thread = threading.get_ident()
+        with self.condition:
+            holders[thread] -= 1
+            if not holders[thread]:
+                del holders[thread]
+                self.condition.notify_all()
+
+    def release_write(self):
+        with self.condition:
+            self.writes -= 1
+            if not self.writes:
+                self.writer = None
+                self.condition.notify_all()
+
+    def release_rows(self, data_ids):
+        with self.condition:
+            for data_id in data_ids:
+                self.rows.pop(data_id, None)
+            self.condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+class ResultCache:
+    """Bounded LRU cache of SELECT results keyed on the query text and its parameters.
+
+    A result is kept as the row tuples and their column offsets, every hit hands out new row views. Writing to a table
+    drops the results read from it.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.results = OrderedDict()
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.results.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.results[key][1]
+
+    def put(self, table_name, key, result):
+        with self.lock:
+            self.results[key] = (table_name, result)
+            self.tables.setdefault(table_name, set()).add(key)
+            while len(self.results) > self.size:
+                key, (table_name, result) = self.results.popitem(last=False)
+                self.tables[table_name].discard(key)
+                self.evictions += 1
+
+    def invalidate(self, table_name):
+        with self.lock:
+            for key in self.tables.pop(table_name, ()):
+                del self.results[key]
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.results),
+                'capacity': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
 
-        self.write_data()
+
+class Transaction:
+    def __init__(self, durability=None):
+        self.durability = durability
+        self.records = []
+        self.undo = []
+        self.locks = []
+        self.rows = []
+
+    def release(self):
+        for table, data_ids in self.rows:
+            table.lock.release_rows(data_ids)
+        for table, mode in reversed(self.locks):
+            if mode == LockMode.WRITE:
+                table.lock.release_write()
+            else:
+                table.lock.release_intent()
+        self.locks = []
+        self.rows = []
+
+
+class Journal:
+    """Database wide redo journal, the commit point of every transaction.
+
+    A transaction is appended as one block of `table, operation, values...` records closed by a commit record, then
+    the records are appended to the table logs without syncing them. The journal is kept until the table logs are
+    synced, and blocks left in it after a crash are appended to the table logs again on startup (replaying a table log
+    is idempotent, so records that were already there are harmless).
+
+    How a commit is made durable depends on its durability: `sync` fsyncs the journal before returning, `group` waits
+    for a background flusher that fsyncs every commit written so far once every `flush_ms` milliseconds or as soon as
+    `flush_records` records are pending, and `async` returns right away, leaving the fsync to the flusher (a crash
+    loses the commits of the last `flush_ms` milliseconds).
+    """
+    COMMIT = 'commit'
+
+    def __init__(self, path, metrics=None, flush_ms=5, flush_records=1000):
+        self.path = path
+        self.metrics = metrics or Metrics()
+        self.file = None
+        self.writer = None
+        self.records = 0
+        self.tables = set()
+        self.lock = threading.RLock()
+        self.flushed = threading.Condition(self.lock)
+        self.flush_ms = flush_ms
+        self.flush_records = flush_records
+        self.flusher = None
+        self.closing = False
+        self.written = 0
+        self.durable = 0
+        self.pending = 0
+        self.unlogged = []
+
+    def recover(self, storage_path):
+        if not os.path.exists(self.path):
+            return
+        block = []
+        committed = []
+        with open(self.path, 'r', newline='') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                record = next(csv.reader([line]))
+                if record == [self.COMMIT]:
+                    committed.extend(block)
+                    block = []
+                else:
+                    block.append(record)
+
+        log_files = {}
+        for record in committed:
+            table_name, record = record[0], record[1:]
+            if table_name not in log_files:
+                log_path = os.path.join(storage_path, f'{table_name}.log')
+                truncate_torn_tail(log_path)
+                log_files[table_name] = open(log_path, 'a', newline='')
+            csv.writer(log_files[table_name]).writerow(record)
+        for log_file in log_files.values():
+            log_file.flush()
+            os.fsync(log_file.fileno())
+            log_file.close()
+        self.truncate()
+
+    def commit(self, transaction, durability=None):
+        """Write a transaction, returns its commit number to `wait` for when it is not synced right away."""
+        durability = durability or Durability.SYNC
+        with self.lock:
+            if not transaction.records:
+                return self.durable
+            if self.file is None:
+                self.file = open(self.path, 'a', newline='')
+                self.writer = csv.writer(self.file)
+            position = self.file.tell()
+            try:
+                self.writer.writerows([table.name] + record for table, record in transaction.records)
+                self.writer.writerow([self.COMMIT])
+                self.file.flush()
+            except BaseException:
+                self.__discard(position)
+                raise
+            self.metrics.count('bytes_written', 'journal', self.file.tell() - position)
+            self.written += 1
+            commit = self.written
+            self.pending += len(transaction.records)
+            self.unlogged.extend(transaction.records)
+            if durability == Durability.SYNC:
+                try:
+                    self.fsync()
+                except BaseException:
+                    self.written -= 1
+                    self.pending -= len(transaction.records)
+                    del self.unlogged[-len(transaction.records):]
+                    self.__discard(position)
+                    raise
+            else:
+                self.start_flusher()
+                self.flushed.notify_all()
+            self.records += len(transaction.records)
+            if self.records >= JOURNAL_SYNC_RECORDS:
+                self.sync()
+            return commit
+
+    def fsync(self):
+        """Make every commit written so far durable with a single fsync, then append its records to the table logs.
+
+        The table logs are only written once the journal is synced: a crash may persist part of an unsynced write,
+        and recovery drops an incomplete journal block but would replay whatever reached a table log.
+        """
+        with self.lock:
+            if self.durable == self.written:
+                return
+            if self.file is not None:
+                with self.metrics.timer('journal_fsync', 'journal'):
+                    os.fsync(self.file.fileno())
+                self.metrics.count('fsyncs', 'journal')
+                self.metrics.count('group_commits', 'journal', self.written - self.durable)
+            table_records = {}
+            for table, record in self.unlogged:
+                table_records.setdefault(table, []).append(record)
+            for table, records in table_records.items():
+                table.write_log(records)
+                self.tables.add(table)
+            self.__mark_durable()
+
+    def __discard(self, position):
+        """Cut a block that failed to commit off the journal, so recovery does not replay it."""
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        self.file = None
+        self.writer = None
+        os.truncate(self.path, position)
+
+    def __mark_durable(self):
+        self.durable = self.written
+        self.pending = 0
+        self.unlogged = []
+        self.flushed.notify_all()
+
+    def wait(self, commit):
+        """Block until commit number `commit` is durable."""
+        with self.lock:
+            self.flushed.wait_for(lambda: self.durable >= commit)
+
+    def start_flusher(self):
+        if self.flusher is None:
+            self.closing = False
+            self.flusher = threading.Thread(target=self.flush_loop, name='journal-flusher', daemon=True)
+            self.flusher.start()
+
+    def flush_loop(self):
+        with self.lock:
+            while not self.closing:
+                # idle until a commit is pending, then give others `flush_ms` to join its group
+                self.flushed.wait_for(lambda: self.closing or self.pending)
+                self.flushed.wait_for(lambda: self.closing or self.pending >= self.flush_records, self.flush_ms / 1000)
+                self.fsync()
+
+    def close(self):
+        """Stop the flusher and make everything durable."""
+        with self.lock:
+            self.closing = True
+            self.flushed.notify_all()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        self.sync()
+
+    def sync(self):
+        """Make the table logs durable, after which the journal is no longer needed."""
+        with self.lock:
+            self.fsync()
+            for table in self.tables:
+                table.sync_log()
+            self.truncate()
+
+    def truncate(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                self.writer = None
+            if os.path.exists(self.path):
+                open(self.path, 'w').close()
+            self.records = 0
+            self.tables = set()
+            self.__mark_durable()
+
+
+def truncate_torn_tail(path):
+    """Cut a partially written last line off a log file so new records start on a fresh line."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        end = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - 4096)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline != -1:
+                if start + newline + 1 != end:
+                    f.truncate(start + newline + 1)
+                return
+            position = start
+        f.truncate(0)
+
+
+class UniqueIndex:
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self.ids = {}
+
+    def build(self, pairs):
+        for item_id, value in pairs:
+            self.add(value, item_id)
+
+    def add(self, value, item_id):
+        self.ids[value] = item_id
+
+    def remove(self, value, item_id):
+        if self.ids.get(value) == item_id:
+            del self.ids[value]
+
+    def lookup(self, value):
+        if value in self.ids:
+            return [self.ids[value]]
+        return []
+
+
+class HashIndex:
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self.ids = {}
+
+    def build(self, pairs):
+        for item_id, value in pairs:
+            self.add(value, item_id)
+
+    def add(self, value, item_id):
+        self.ids.setdefault(value, set()).add(item_id)
+
+    def remove(self, value, item_id):
+        if value in self.ids:
+            self.ids[value].discard(item_id)
+            if not self.ids[value]:
+                del self.ids[value]
+
+    def lookup(self, value):
+        return self.ids.get(value, set())
+
+
+class SortedIndex:
+    """(value, id) pairs kept in order, equality and range lookups bisect to the first match and read the matches.
+
+    The pairs are held in sorted chunks of at most `2 * CHUNK` pairs, `maxes` holding the last pair of every chunk, so
+    adding or removing a pair moves the pairs of one chunk instead of every pair after it.
+    """
+    CHUNK = 1024
+
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self.chunks = []
+        self.maxes = []
+
+    def build(self, pairs):
+        entries = sorted((value, item_id) for item_id, value in pairs)
+        self.chunks = [entries[start:start + self.CHUNK] for start in range(0, len(entries), self.CHUNK)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+
+    def __iter__(self):
+        return (entry for chunk in self.chunks for entry in chunk)
+
+    def __reversed__(self):
+        return (entry for chunk in reversed(self.chunks) for entry in reversed(chunk))
+
+    def add(self, value, item_id):
+        entry = (value, item_id)
+        if not self.chunks:
+            self.chunks.append([entry])
+            self.maxes.append(entry)
+            return
+        position = min(bisect.bisect_left(self.maxes, entry), len(self.maxes) - 1)
+        chunk = self.chunks[position]
+        bisect.insort(chunk, entry)
+        self.maxes[position] = chunk[-1]
+        if len(chunk) > 2 * self.CHUNK:
+            self.chunks[position:position + 1] = [chunk[:self.CHUNK], chunk[self.CHUNK:]]
+            self.maxes[position:position + 1] = [chunk[self.CHUNK - 1], chunk[-1]]
+
+    def remove(self, value, item_id):
+        entry = (value, item_id)
+        position = bisect.bisect_left(self.maxes, entry)
+        if position == len(self.maxes):
+            return
+        chunk = self.chunks[position]
+        offset = bisect.bisect_left(chunk, entry)
+        if chunk[offset] != entry:
+            return
+        del chunk[offset]
+        if chunk:
+            self.maxes[position] = chunk[-1]
+        else:
+            del self.chunks[position]
+            del self.maxes[position]
+
+    def lookup(self, value):
+        return self.range(value, value)
+
+    def range(self, low=None, high=None, include_low=True, include_high=True):
+        key = itemgetter(0)
+        find_low = bisect.bisect_left if include_low else bisect.bisect_right
+        find_high = bisect.bisect_right if include_high else bisect.bisect_left
+        item_ids = []
+        for position in range(0 if low is None else find_low(self.maxes, low, key=key), len(self.chunks)):
+            chunk = self.chunks[position]
+            start = 0 if low is None else find_low(chunk, low, key=key)
+            end = len(chunk) if high is None else find_high(chunk, high, key=key)
+            item_ids.extend(item_id for value, item_id in chunk[start:end])
+            if end < len(chunk):
+                break
+        return item_ids
+
+
+class Sequence:
+    def __init__(self, start=1):
+        self.start = start
+        self.value = None
+
+    def next(self, step=1):
+        self.value = self.start if self.value is None else self.value + step
+        return self.value
+
+    def advance(self, value):
+        if self.value is None or value > self.value:
+            self.value = value
+
+
+class LogOperation:
+    INSERT = 'insert'
+    UPDATE = 'update'
+    PATCH = 'patch'
+    DELETE = 'delete'
 
 
 class DataType:
@@ -251,6 +1835,48 @@ class DataType:
     INT = 'integer'
     BOOL = 'boolean'
     TIMESTAMP = 'timestamp'
+    VERSION = 'version'
+
+
+def decode_bool(value):
+    return value not in FALSE_VALUES
+
+
+def decode_int_column(values):
+    if numpy is not None and len(values):
+        try:
+            return numpy.array(values).astype(numpy.int64).tolist()
+        except (ValueError, OverflowError):
+            pass
+    return list(map(int, values))
+
+
+def decode_bool_column(values):
+    if numpy is not None and len(values):
+        return numpy.logical_not(numpy.isin(numpy.array(values), FALSE_VALUES)).tolist()
+    return [value not in FALSE_VALUES for value in values]
+
+
+class Codec:
+    """Conversion of a column type between its text form, in queries, snapshots and logs, and python values.
+
+    `decode_column` converts a whole column at once, with NumPy for the numeric types when it is installed.
+    """
+
+    def __init__(self, decode, decode_column, encode=str):
+        self.decode = decode
+        self.decode_column = decode_column
+        self.encode = encode
+
+
+CODECS = {
+    DataType.ID: Codec(int, decode_int_column),
+    DataType.CHAR: Codec(str, list),
+    DataType.INT: Codec(int, decode_int_column),
+    DataType.BOOL: Codec(decode_bool, decode_bool_column),
+    DataType.TIMESTAMP: Codec(str, list),
+    DataType.VERSION: Codec(int, decode_int_column),
+}
 
 
 class Field:
@@ -259,38 +1885,66 @@ class Field:
         self.type = None
         self.length = 256
         self.is_unique = False
+        self.is_indexed = False
+        self.is_sorted = False
+        self.sequence_start = None
+        self.default = None
+        self.codec = None
         self.set_type(type)
 
     def set_type(self, type):
         is_unique = False
+        is_indexed = False
         type = type.strip()
         if 'unique' in type:
             is_unique = True
-            type = type.replace('unique', '')
-        if match := re.search('^\s*char\((.*)\)$', type):
+            type = type.replace('unique', '').strip()
+        if 'index' in type:
+            is_indexed = True
+            type = type.replace('index', '').strip()
+        is_sorted = False
+        if 'sorted' in type:
+            is_sorted = True
+            type = type.replace('sorted', '').strip()
+        sequence_start = None
+        if match := SEQUENCE_PATTERN.search(type):
+            sequence_start = int(match.group(1) or 1)
+            type = type.replace(match.group(0), '').strip()
+        if match := CHAR_PATTERN.search(type):
             type = DataType.CHAR
             length = match.group(1)
         else:
             length = self.length
 
-        if type not in [DataType.ID, DataType.CHAR, DataType.INT, DataType.BOOL, DataType.TIMESTAMP]:
+        if type not in CODECS:
             raise RuntimeError(f"{type} is an invalid type")
         self.type = type
+        self.codec = CODECS[type]
+        # bound once, parsing a value is then a single call instead of a walk over the types
+        self.parse = self.codec.decode
+        self.encode = self.codec.encode
+        self.decode_column = self.codec.decode_column
         self.length = length
         self.is_unique = is_unique
+        self.is_indexed = is_indexed
+        self.is_sorted = is_sorted
+        self.sequence_start = sequence_start
         if type == DataType.ID:
             self.is_unique = True
+            self.sequence_start = 1
+        # the version of a row starts at 1 and is incremented by every write of the row
+        self.default = 1 if type == DataType.VERSION else None
 
-    def parse(self, value):
-        if self.type == DataType.ID:
-            return int(value)
-        if self.type == DataType.CHAR:
-            return value.strip('"')
-        elif self.type == DataType.INT:
-            return int(value)
+    def binary_format(self):
+        if self.type in [DataType.ID, DataType.INT, DataType.VERSION]:
+            return 'q'
         elif self.type == DataType.BOOL:
-            if value in ['0', 'False', 'false']:
-                return False
-            return True
-        elif self.type == DataType.TIMESTAMP:
-            return value.strip('"')
+            return '?'
+        return BinaryStorage.STRING
+
+    def coerce(self, value):
+        """Parse a query literal, or convert a python value, to the type of the field."""
+        try:
+            return self.parse(str(value))
+        except ValueError:
+            raise RuntimeError(f"Invalid value `{value}` for field {self.name} of type {self.type}")
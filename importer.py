@@ -0,0 +1,55 @@
+import os
+import csv
+import json
+import argparse
+from itertools import islice
+
+from database import Database
+
+
+def read_csv(path):
+    with open(path, 'r', newline='') as f:
+        yield from csv.DictReader(f)
+
+
+def read_jsonl(path):
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+READERS = {
+    '.csv': read_csv,
+    '.jsonl': read_jsonl,
+}
+
+
+def import_file(db, table_name, path, chunk_size=10000):
+    """Stream a CSV or JSONL file into a table, one insert_many transaction per chunk of rows."""
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        rows = READERS[extension](path)
+    except KeyError:
+        raise RuntimeError(f'Unsupported file type {extension}, expected one of {list(READERS)}')
+
+    total = 0
+    while chunk := list(islice(rows, chunk_size)):
+        db.insert_many(table_name, chunk)
+        total += len(chunk)
+        print(f"Imported {total} records into {table_name}")
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a CSV or JSONL file into a table.')
+    parser.add_argument('table')
+    parser.add_argument('path')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--schema', default='schema.txt')
+    parser.add_argument('--storage', default='db')
+    args = parser.parse_args()
+
+    db = Database(args.schema, args.storage)
+    import_file(db, args.table, args.path, args.chunk_size)
+    db.close()
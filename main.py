@@ -1,11 +1,17 @@
+import argparse
 import traceback
 
 from actions import ActionHandler
+from client import RemoteDatabase
 from database import Database
 from utils import print_msg_box
 
 if __name__ == '__main__':
-    db = Database()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--connect', help='use the database served at host:port or a Unix socket path')
+    args = parser.parse_args()
+
+    db = RemoteDatabase(args.connect) if args.connect else Database(result_cache_size=1024)
     current_user = None
 
     action_handler = ActionHandler(current_user, db)
@@ -31,3 +37,4 @@ if __name__ == '__main__':
             break
         finally:
             print('=' * 40)
+    db.close()
@@ -0,0 +1,110 @@
+import json
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+LATENCY_BUCKETS_MS = [0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000]
+
+
+class Histogram:
+    """Latencies counted in fixed millisecond buckets, the last bucket holds everything above the largest bound."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, milliseconds):
+        for position, bound in enumerate(LATENCY_BUCKETS_MS):
+            if milliseconds <= bound:
+                break
+        else:
+            position = len(LATENCY_BUCKETS_MS)
+        self.buckets[position] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def snapshot(self):
+        labels = [f'<={bound}ms' for bound in LATENCY_BUCKETS_MS] + [f'>{LATENCY_BUCKETS_MS[-1]}ms']
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0,
+            'max_ms': round(self.max, 3),
+            'buckets': dict(zip(labels, self.buckets)),
+        }
+
+
+class Metrics:
+    """Latency histograms and counters of a database, grouped by name and table.
+
+    Queries slower than `slow_query_ms` are appended to the `slow_query_log` file when one is configured.
+    """
+
+    def __init__(self, slow_query_log=None, slow_query_ms=100):
+        self.histograms = {}
+        self.counters = {}
+        self.slow_query_log = slow_query_log
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = 0
+        self.slow_query_file = None
+        self.lock = threading.Lock()
+
+    def observe(self, name, table_name, milliseconds):
+        with self.lock:
+            histograms = self.histograms.setdefault(name, {})
+            if table_name not in histograms:
+                histograms[table_name] = Histogram()
+            histograms[table_name].observe(milliseconds)
+
+    def count(self, name, table_name, amount=1):
+        with self.lock:
+            counters = self.counters.setdefault(name, {})
+            counters[table_name] = counters.get(table_name, 0) + amount
+
+    @contextmanager
+    def timer(self, name, table_name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, table_name, (time.perf_counter() - started) * 1000)
+
+    def query(self, query, parameters, milliseconds):
+        """Record a query in the slow query log if it took longer than the threshold."""
+        if self.slow_query_log is None or milliseconds < self.slow_query_ms:
+            return
+        parameters = f' {list(parameters)!r}' if parameters else ''
+        with self.lock:
+            self.slow_queries += 1
+            if self.slow_query_file is None:
+                self.slow_query_file = open(self.slow_query_log, 'a')
+            self.slow_query_file.write(f'{datetime.now().isoformat()} {milliseconds:.3f}ms {query}{parameters}\n')
+            self.slow_query_file.flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'latency': {
+                    name: {table_name: histogram.snapshot() for table_name, histogram in histograms.items()}
+                    for name, histograms in self.histograms.items()
+                },
+                'counters': {name: dict(counters) for name, counters in self.counters.items()},
+                'slow_queries': self.slow_queries,
+            }
+
+    def dump(self, path=None):
+        """The snapshot as JSON, also written to `path` when given."""
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def close(self):
+        if self.slow_query_file is not None:
+            self.slow_query_file.close()
+            self.slow_query_file = None
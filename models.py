@@ -1,4 +1,6 @@
+import time
 import random
+import weakref
 from datetime import datetime
 from prettytable import PrettyTable
 from database import Database
@@ -6,33 +8,76 @@ from utils import prompt, validate_phone_number, validate_national_number, valid
     table_footer, validate_email
 
 
+CONFLICT_RETRIES = 10
+
+
+def where_clause(where_list):
+    return ' and '.join([f'{w[0]} {w[1]} ?' for w in where_list])
+
+
+class Conflict(RuntimeError):
+    """A row was changed by another transaction between the time it was read and the time it was written."""
+
+
 class BaseModel:
+    # prepared statements by connection and query shape, models are created for every action and share them
+    statements = weakref.WeakKeyDictionary()
+
     def __init__(self, db_connection: Database, table_name):
         self.db_connection = db_connection
         self.table_name = table_name
 
+    def prepare(self, shape, build_query):
+        """The statement prepared for `shape`, the query is only built the first time the shape is used."""
+        statements = self.statements.setdefault(self.db_connection, {})
+        key = (self.table_name, shape)
+        if (statement := statements.get(key)) is None:
+            statement = statements[key] = self.db_connection.prepare(build_query())
+        return statement
+
     def first_by(self, field, value):
         return self.first([[field, '==', value]])
 
     def first(self, where_list=None):
-        where_str = ' and '.join([f'{w[0]} {w[1]} {w[2]}' for w in where_list])
-        items = self.db_connection.run_query(f'select from {self.table_name} where {where_str};')
-        if items:
-            return items[0]
-        return None
+        statement = self.prepare(
+            ('first', *[(w[0], w[1]) for w in where_list]),
+            lambda: f'select from {self.table_name} where {where_clause(where_list)} limit 1;')
+        return next(statement.iter(*[w[2] for w in where_list]), None)
 
     def all(self, where_list=None):
-        if where_list:
-            where_str = ' where ' + ' and '.join([f'{w[0]} {w[1]} {w[2]}' for w in where_list])
-        else:
-            where_str = ''
-        return self.db_connection.run_query(f'select from {self.table_name}{where_str};')
+        where_list = where_list or []
+        statement = self.prepare(
+            ('all', *[(w[0], w[1]) for w in where_list]),
+            lambda: f'select from {self.table_name}{" where " + where_clause(where_list) if where_list else ""};')
+        return statement.execute(*[w[2] for w in where_list])
 
     def insert(self, field_values_pair):
-        fields = field_values_pair.keys()
-        values = [str(value) for value in field_values_pair.values()]
-        return self.db_connection.run_query(
-            f"insert into {self.table_name} ({','.join(fields)}) values ({','.join(values)});")
+        fields = tuple(field_values_pair)
+        statement = self.prepare(
+            ('insert', *fields),
+            lambda: f"insert into {self.table_name} ({','.join(fields)}) values ({','.join('?' * len(fields))});")
+        return statement.execute(*field_values_pair.values())
+
+    def compare_and_set(self, row, field_values_pair):
+        """Update `row` only if no one wrote it since it was read, which is told by its version."""
+        fields = tuple(field_values_pair)
+        statement = self.prepare(
+            ('compare_and_set', *fields),
+            lambda: f"update {self.table_name} set {', '.join(f'{field} = ?' for field in fields)} "
+                    f"where id == ? and version == ?;")
+        if statement.execute(*field_values_pair.values(), row['id'], row['version']) != 1:
+            raise Conflict(f'{self.table_name} {row["id"]} was changed by another transaction.')
+
+    @staticmethod
+    def retry(operation, retries=CONFLICT_RETRIES):
+        """Run `operation` again while it conflicts with other transactions, waiting a little longer each time."""
+        for attempt in range(retries):
+            try:
+                return operation()
+            except Conflict:
+                if attempt == retries - 1:
+                    raise
+                time.sleep(random.uniform(0, 0.001 * 2 ** attempt))
 
 
 class User(BaseModel):
@@ -142,28 +187,26 @@ class Account(BaseModel):
         return self.amount
 
     def __generate_number(self):
-        numbers = [item['number'] for item in self.all()]
-        if not numbers:
-            return 10000
-        return str(int(max(numbers)) + random.randint(5, 9))
+        return self.db_connection.next_value(self.table_name, 'number', random.randint(5, 9))
 
     def open_account(self):
-        account = self.insert({
-            'user_id': self.user.id,
-            'amount': self.amount,
-            'number': self.__generate_number(),
-            'password': self.password,
-            'alias': self.alias,
-            'created_time': datetime.now().isoformat()
-        })
-        transaction = Transaction(self)
-        transaction.new_transaction({
-            'amount': self.amount,
-            'description': 'Open account',
-            'account_id': 0,
-            'destination_id': account['id'],
-            'created_time': datetime.now().isoformat()
-        })
+        with self.db_connection.transaction():
+            account = self.insert({
+                'user_id': self.user.id,
+                'amount': self.amount,
+                'number': self.__generate_number(),
+                'password': self.password,
+                'alias': self.alias,
+                'created_time': datetime.now().isoformat()
+            })
+            transaction = Transaction(self)
+            transaction.new_transaction({
+                'amount': self.amount,
+                'description': 'Open account',
+                'account_id': 0,
+                'destination_id': account['id'],
+                'created_time': datetime.now().isoformat()
+            })
 
     def fetch_by_alias(self):
         if not self.alias:
@@ -212,37 +255,33 @@ class Account(BaseModel):
         transaction.show_list(account)
         return account
 
-    @staticmethod
-    def convert_to_values(account):
-        return ','.join([str(item) for item in [account['id'], account['user_id'], account['amount'], account['number'],
-                                                account['password'], account['alias'], account['created_time']]])
-
     def transfer(self, selected_account, destination_account, amount):
-        selected_account['amount'] = str(int(selected_account['amount']) - int(amount))
-        destination_account['amount'] = str(int(destination_account['amount']) + int(amount))
-        selected_account_values = self.convert_to_values(selected_account)
-        destination_account_values = self.convert_to_values(destination_account)
-        self.db_connection.run_query(
-            f"update {self.table_name} where id == {selected_account['id']} values ({selected_account_values});"
-        )
-        self.db_connection.run_query(
-            f"update {self.table_name} where id == {destination_account['id']} values ({destination_account_values});"
-        )
-        transaction = Transaction(self)
-        transaction.new_transaction({
-            'amount': amount,
-            'description': 'Transfer money',
-            'account_id': selected_account['id'],
-            'destination_id': destination_account['id'],
-            'created_time': datetime.now().isoformat()
-        })
+        amount = int(amount)
+
+        def transfer_once():
+            # read outside the transaction, the versions tell at write time whether the balances are still current
+            source = self.first_by('id', selected_account['id'])
+            destination = self.first_by('id', destination_account['id'])
+            if source['amount'] < amount:
+                raise RuntimeError('Insufficient balance.')
+            with self.db_connection.transaction():
+                if source['id'] != destination['id']:
+                    self.compare_and_set(source, {'amount': source['amount'] - amount})
+                    self.compare_and_set(destination, {'amount': destination['amount'] + amount})
+                transaction = Transaction(self)
+                transaction.new_transaction({
+                    'amount': amount,
+                    'description': 'Transfer money',
+                    'account_id': source['id'],
+                    'destination_id': destination['id'],
+                    'created_time': datetime.now().isoformat()
+                })
+
+        self.retry(transfer_once)
 
     def update_account(self, selected_account):
-        selected_account['alias'] = self.alias
-        selected_account_values = self.convert_to_values(selected_account)
-        self.db_connection.run_query(
-            f"update {self.table_name} where id == {selected_account['id']} values ({selected_account_values});"
-        )
+        self.db_connection.prepare(f"update {self.table_name} set alias = ? where id == ?;").execute(
+            self.alias, selected_account['id'])
 
     @staticmethod
     def validate_amount(selected_account, amount):
@@ -266,17 +305,24 @@ class Transaction(BaseModel):
     def new_transaction(self, data):
         self.insert(data)
 
-    def show_list(self, account):
+    def show_list(self, account, page_size=20):
         account_id = account['id']
-        transactions = self.db_connection.run_query(
-            f'select from {self.table_name} where account_id == {account_id} or destination_id == {account_id};'
+        # one page is read per query, a page more than shown tells whether there is a next one
+        select_page = self.db_connection.prepare(
+            f'select from {self.table_name} where account_id == ? or destination_id == ? order by id limit ? offset ?;'
         )
-        transactions_table = PrettyTable(['row', 'amount', 'description', 'created time'])
-        for row, transaction in enumerate(transactions, 1):
-            amount = ('+' if transaction['destination_id'] == account_id else '-') + str(transaction['amount'])
-            transactions_table.add_row([row, amount, transaction['description'], transaction['created_time']])
+        row = 0
+        while True:
+            page = select_page.execute(account_id, account_id, page_size + 1, row)
+            transactions_table = PrettyTable(['row', 'amount', 'description', 'created time'])
+            for transaction in page[:page_size]:
+                row += 1
+                amount = ('+' if transaction['destination_id'] == account_id else '-') + str(transaction['amount'])
+                transactions_table.add_row([row, amount, transaction['description'], transaction['created_time']])
+            print(transactions_table)
+            if len(page) <= page_size or input('Show more transactions? (y/n) ').lower() != 'y':
+                break
 
-        print(transactions_table)
         print(table_footer(transactions_table, 'Sum', {'amount': account['amount']}))
 
 
@@ -322,32 +368,20 @@ class Bill(BaseModel):
         ])
         print(bills_table)
 
-    @staticmethod
-    def convert_to_values(bill):
-        return ','.join([str(item) for item in [bill['id'], bill['user_id'], bill['amount'], bill['description'],
-                                                bill['bill_id'], bill['payment_code'], bill['status']]])
-
     def pay_bill(self, selected_account):
         bill = self.fetch_by_bill_id_and_payment_code()
         amount = bill['amount']
 
-        selected_account['amount'] = str(int(selected_account['amount']) - int(amount))
-        selected_account_values = Account.convert_to_values(selected_account)
-        self.db_connection.run_query(
-            f"update accounts where id == {selected_account['id']} values ({selected_account_values});"
-        )
-
-        bill['status'] = 1
-        bill_values = self.convert_to_values(bill)
-        self.db_connection.run_query(
-            f"update {self.table_name} where id == {bill['id']} values ({bill_values});"
-        )
-
-        transaction = Transaction(self)
-        transaction.new_transaction({
-            'amount': bill['amount'],
-            'description': 'Bill payment',
-            'account_id': selected_account['id'],
-            'destination_id': 0,
-            'created_time': datetime.now().isoformat()
-        })
+        with self.db_connection.transaction():
+            self.db_connection.prepare("update accounts set amount = amount - ? where id == ?;").execute(
+                int(amount), selected_account['id'])
+            self.db_connection.prepare(f"update {self.table_name} set status = ? where id == ?;").execute(
+                True, bill['id'])
+            transaction = Transaction(self)
+            transaction.new_transaction({
+                'amount': bill['amount'],
+                'description': 'Bill payment',
+                'account_id': selected_account['id'],
+                'destination_id': 0,
+                'created_time': datetime.now().isoformat()
+            })
@@ -0,0 +1,474 @@
+import re
+import threading
+from collections import OrderedDict
+
+AGGREGATES = ('count', 'sum', 'min', 'max')
+FUNCTIONS = AGGREGATES + ('date',)
+
+TOKEN_PATTERN = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<operator>==|!=|<=|>=|<|>|=)
+  | (?P<arithmetic>[+*/]|-(?=\s)|(?<=[\w)])-)
+  | (?P<punctuation>[(),;])
+  | (?P<parameter>\?(?=[\s(),;]|$))
+  | (?P<word>\d{4}-\d\d-\d\d[^\s(),;"'=!<>]*|(?:[^\s(),;"'=!<>+*/-]|(?<![\w)])-)+)
+''', re.VERBOSE)
+
+
+class Token:
+    STRING = 'string'
+    OPERATOR = 'operator'
+    ARITHMETIC = 'arithmetic'
+    PUNCTUATION = 'punctuation'
+    PARAMETER = 'parameter'
+    WORD = 'word'
+
+    def __init__(self, kind, text, start, end):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.end = end
+
+    def is_keyword(self, *keywords):
+        return self.kind == Token.WORD and self.text.lower() in keywords
+
+    def is_punctuation(self, *punctuations):
+        return self.kind == Token.PUNCTUATION and self.text in punctuations
+
+
+def tokenize(query):
+    tokens = []
+    position = 0
+    while position < len(query):
+        match = TOKEN_PATTERN.match(query, position)
+        if not match:
+            raise RuntimeError(f"Invalid query `{query}`: unexpected character {query[position]!r} at {position}")
+        if match.lastgroup != 'space':
+            tokens.append(Token(match.lastgroup, match.group(), match.start(), match.end()))
+        position = match.end()
+    return tokens
+
+
+def unquote(text):
+    return re.sub(r'\\(.)', r'\1', text[1:-1])
+
+
+class Select:
+    def __init__(self, table, where=None, order_by=None, limit=None, offset=0, columns=None, group_by=None):
+        self.table = table
+        self.where = where
+        self.order_by = order_by or []
+        self.limit = limit
+        self.offset = offset
+        self.columns = columns
+        self.group_by = group_by or []
+
+
+class Column:
+    """An item of a SELECT list or GROUP BY, `field` is None for `count(*)`."""
+
+    def __init__(self, field, function=None, alias=None):
+        self.field = field
+        self.function = function
+        self.alias = alias
+
+    @property
+    def label(self):
+        if self.alias:
+            return self.alias
+        if self.function is None:
+            return self.field
+        return f'{self.function}({self.field or "*"})'
+
+
+class Insert:
+    def __init__(self, table, columns, rows):
+        self.table = table
+        self.columns = columns
+        self.rows = rows
+
+
+class Update:
+    def __init__(self, table, where, values=None, assignments=None):
+        self.table = table
+        self.where = where
+        self.values = values
+        self.assignments = assignments
+
+
+class Parameter:
+    """A `?` placeholder, `index` is its position among the placeholders of the query."""
+
+    def __init__(self, index):
+        self.index = index
+
+
+class Assignment:
+    def __init__(self, column, expression):
+        self.column = column
+        self.expression = expression
+
+
+class Literal:
+    def __init__(self, value):
+        self.value = value
+
+
+class Name:
+    """A bare word in an expression, a column reference when the table has such a column and a literal otherwise."""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class BinaryOperation:
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+
+class Delete:
+    def __init__(self, table, where=None):
+        self.table = table
+        self.where = where
+
+
+class Begin:
+    pass
+
+
+class Commit:
+    pass
+
+
+class Rollback:
+    pass
+
+
+class Comparison:
+    def __init__(self, field, operator, value):
+        self.field = field
+        self.operator = operator
+        self.value = value
+
+
+class Between:
+    def __init__(self, field, low, high):
+        self.field = field
+        self.low = low
+        self.high = high
+
+
+class And:
+    def __init__(self, conditions):
+        self.conditions = conditions
+
+
+class Or:
+    def __init__(self, conditions):
+        self.conditions = conditions
+
+
+class Parser:
+    """Recursive descent parser, AND binds tighter than OR and parentheses group conditions."""
+
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.position = 0
+        self.parameters = 0
+
+    def error(self, message):
+        raise RuntimeError(f"Invalid query `{self.query}`: {message}")
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            self.error('unexpected end of query')
+        self.position += 1
+        return token
+
+    def expect_keyword(self, keyword):
+        token = self.next()
+        if not token.is_keyword(keyword):
+            self.error(f'expected {keyword.upper()} but found `{token.text}`')
+        return token
+
+    def expect_punctuation(self, punctuation):
+        token = self.next()
+        if not token.is_punctuation(punctuation):
+            self.error(f'expected `{punctuation}` but found `{token.text}`')
+        return token
+
+    def accept_keyword(self, keyword):
+        token = self.peek()
+        if token is not None and token.is_keyword(keyword):
+            self.position += 1
+            return True
+        return False
+
+    def identifier(self):
+        token = self.next()
+        if token.kind != Token.WORD or not re.fullmatch(r'\w+', token.text):
+            self.error(f'expected a name but found `{token.text}`')
+        return token.text.lower()
+
+    def parameter(self):
+        self.parameters += 1
+        return Parameter(self.parameters - 1)
+
+    def value(self, stop_keywords=()):
+        """A quoted string, a `?` placeholder, or a run of bare words taken verbatim from the query."""
+        token = self.next()
+        if token.kind == Token.STRING:
+            return unquote(token.text)
+        if token.kind == Token.PARAMETER:
+            return self.parameter()
+        if token.kind != Token.WORD:
+            self.error(f'expected a value but found `{token.text}`')
+        first = last = token
+        while (token := self.peek()) is not None and (
+                token.kind == Token.WORD and not token.is_keyword(*stop_keywords) or self.attached(token, last)):
+            last = self.next()
+        return self.query[first.start:last.end]
+
+    @staticmethod
+    def attached(token, last):
+        """An operator written right after the previous token of a bare value, as in `a-b/c`, is part of the value."""
+        return token.kind == Token.ARITHMETIC and token.start == last.end
+
+    def parse(self):
+        token = self.next()
+        if token.is_keyword('select'):
+            statement = self.parse_select()
+        elif token.is_keyword('insert'):
+            statement = self.parse_insert()
+        elif token.is_keyword('update'):
+            statement = self.parse_update()
+        elif token.is_keyword('delete'):
+            statement = self.parse_delete()
+        elif token.is_keyword('begin'):
+            statement = Begin()
+        elif token.is_keyword('commit'):
+            statement = Commit()
+        elif token.is_keyword('rollback'):
+            statement = Rollback()
+        else:
+            self.error(f'unknown statement `{token.text}`')
+        self.expect_punctuation(';')
+        if self.peek() is not None:
+            self.error(f'unexpected `{self.peek().text}` after `;`')
+        return statement
+
+    def parse_select(self):
+        columns = None
+        token = self.peek()
+        if token is not None and token.kind == Token.ARITHMETIC and token.text == '*':
+            self.next()
+        elif token is not None and not token.is_keyword('from'):
+            columns = [self.parse_column()]
+            while self.peek() is not None and self.peek().is_punctuation(','):
+                self.next()
+                columns.append(self.parse_column())
+        self.expect_keyword('from')
+        table = self.identifier()
+        where = self.parse_where(('and', 'or', 'group', 'order', 'limit', 'offset'))
+        group_by = []
+        if self.accept_keyword('group'):
+            self.expect_keyword('by')
+            group_by.append(self.parse_column(alias=False))
+            while self.peek() is not None and self.peek().is_punctuation(','):
+                self.next()
+                group_by.append(self.parse_column(alias=False))
+        order_by = []
+        if self.accept_keyword('order'):
+            self.expect_keyword('by')
+            order_by.append(self.parse_order())
+            while self.peek() is not None and self.peek().is_punctuation(','):
+                self.next()
+                order_by.append(self.parse_order())
+        limit = self.parse_count('limit')
+        offset = self.parse_count('offset')
+        return Select(table, where, order_by, limit, offset or 0, columns, group_by)
+
+    def parse_column(self, alias=True):
+        """A field, `function(field)` or `count(*)`, optionally followed by `AS name`."""
+        field = self.identifier()
+        function = None
+        if self.peek() is not None and self.peek().is_punctuation('('):
+            self.next()
+            function = field
+            if function not in FUNCTIONS:
+                self.error(f'unknown function `{function}`')
+            token = self.peek()
+            if function == 'count' and token is not None and token.kind == Token.ARITHMETIC and token.text == '*':
+                self.next()
+                field = None
+            else:
+                field = self.identifier()
+            self.expect_punctuation(')')
+        return Column(field, function, self.identifier() if alias and self.accept_keyword('as') else None)
+
+    def parse_order(self):
+        """(field, descending) of one ORDER BY key."""
+        field = self.identifier()
+        if self.accept_keyword('desc'):
+            return field, True
+        self.accept_keyword('asc')
+        return field, False
+
+    def parse_count(self, keyword):
+        if not self.accept_keyword(keyword):
+            return None
+        token = self.next()
+        if token.kind == Token.PARAMETER:
+            return self.parameter()
+        if token.kind != Token.WORD or not token.text.isdigit():
+            self.error(f'expected a number after {keyword.upper()} but found `{token.text}`')
+        return int(token.text)
+
+    def parse_insert(self):
+        self.expect_keyword('into')
+        table = self.identifier()
+        columns = None
+        if self.peek() is not None and self.peek().is_punctuation('('):
+            self.next()
+            columns = self.parse_list(self.identifier)
+        self.expect_keyword('values')
+        rows = [self.parse_row()]
+        while self.peek() is not None and self.peek().is_punctuation(','):
+            self.next()
+            rows.append(self.parse_row())
+        return Insert(table, columns, rows)
+
+    def parse_row(self):
+        self.expect_punctuation('(')
+        return self.parse_list(self.value)
+
+    def parse_update(self):
+        table = self.identifier()
+        if self.accept_keyword('set'):
+            assignments = [self.parse_assignment()]
+            while self.peek() is not None and self.peek().is_punctuation(','):
+                self.next()
+                assignments.append(self.parse_assignment())
+            return Update(table, self.parse_where(), assignments=assignments)
+        self.expect_keyword('where')
+        where = self.parse_condition(('and', 'or', 'values'))
+        self.expect_keyword('values')
+        self.expect_punctuation('(')
+        return Update(table, where, self.parse_list(self.value))
+
+    def parse_assignment(self):
+        column = self.identifier()
+        operator = self.next()
+        if operator.kind != Token.OPERATOR or operator.text != '=':
+            self.error(f'expected `=` after `{column}` but found `{operator.text}`')
+        return Assignment(column, self.parse_expression())
+
+    def parse_expression(self):
+        expression = self.parse_term()
+        while (token := self.peek()) is not None and token.kind == Token.ARITHMETIC and token.text in '+-':
+            self.next()
+            expression = BinaryOperation(token.text, expression, self.parse_term())
+        return expression
+
+    def parse_term(self):
+        expression = self.parse_operand()
+        while (token := self.peek()) is not None and token.kind == Token.ARITHMETIC and token.text in '*/':
+            self.next()
+            expression = BinaryOperation(token.text, expression, self.parse_operand())
+        return expression
+
+    def parse_operand(self):
+        token = self.peek()
+        if token is not None and token.is_punctuation('('):
+            self.next()
+            expression = self.parse_expression()
+            self.expect_punctuation(')')
+            return expression
+        if token is not None and token.kind == Token.WORD and re.fullmatch(r'\w+', token.text):
+            following = self.tokens[self.position + 1] if self.position + 1 < len(self.tokens) else None
+            if following is None or following.kind != Token.WORD or following.is_keyword('where'):
+                self.next()
+                return Name(token.text)
+        return Literal(self.value(('where',)))
+
+    def parse_delete(self):
+        self.expect_keyword('from')
+        table = self.identifier()
+        return Delete(table, self.parse_where())
+
+    def parse_where(self, stop_keywords=('and', 'or')):
+        if self.accept_keyword('where'):
+            return self.parse_condition(stop_keywords)
+        return None
+
+    def parse_list(self, parse_item):
+        """Comma separated items up to the closing parenthesis, the opening one is already consumed."""
+        items = [parse_item()]
+        while self.next().is_punctuation(','):
+            items.append(parse_item())
+        if not self.tokens[self.position - 1].is_punctuation(')'):
+            self.error(f'expected `,` or `)` but found `{self.tokens[self.position - 1].text}`')
+        return items
+
+    def parse_condition(self, stop_keywords):
+        conditions = [self.parse_and(stop_keywords)]
+        while self.accept_keyword('or'):
+            conditions.append(self.parse_and(stop_keywords))
+        return conditions[0] if len(conditions) == 1 else Or(conditions)
+
+    def parse_and(self, stop_keywords):
+        conditions = [self.parse_primary(stop_keywords)]
+        while self.accept_keyword('and'):
+            conditions.append(self.parse_primary(stop_keywords))
+        return conditions[0] if len(conditions) == 1 else And(conditions)
+
+    def parse_primary(self, stop_keywords):
+        token = self.peek()
+        if token is not None and token.is_punctuation('('):
+            self.next()
+            condition = self.parse_condition(stop_keywords)
+            self.expect_punctuation(')')
+            return condition
+        field = self.identifier()
+        if self.accept_keyword('between'):
+            low = self.value(stop_keywords)
+            self.expect_keyword('and')
+            return Between(field, low, self.value(stop_keywords))
+        operator = self.next()
+        if operator.kind != Token.OPERATOR:
+            self.error(f'expected an operator after `{field}` but found `{operator.text}`')
+        return Comparison(field, operator.text, self.value(stop_keywords))
+
+
+class PlanCache:
+    """Bounded LRU cache of parsed statements keyed on the normalized query text."""
+
+    def __init__(self, size=256):
+        self.size = size
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.plans.move_to_end(key)
+                return self.plans[key]
+            except KeyError:
+                return None
+
+    def put(self, key, plan):
+        with self.lock:
+            self.plans[key] = plan
+            self.plans.move_to_end(key)
+            while len(self.plans) > self.size:
+                self.plans.popitem(last=False)
@@ -0,0 +1,169 @@
+import json
+import struct
+import asyncio
+import argparse
+from collections.abc import Mapping
+
+from database import Database
+
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+def encode_frame(message):
+    """A message as JSON prefixed with its length, the framing used in both directions."""
+    body = json.dumps(message, default=to_json).encode()
+    return FRAME_HEADER.pack(len(body)) + body
+
+
+def decode_body(body):
+    return json.loads(body.decode())
+
+
+def to_json(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f'{type(value).__name__} can not be sent to a client')
+
+
+async def read_frame(reader):
+    """The next message of a connection, None once the client has disconnected."""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_BYTES:
+        raise RuntimeError(f'Frame of {size} bytes is larger than {MAX_FRAME_BYTES}')
+    return decode_body(await reader.readexactly(size))
+
+
+class Server:
+    """Serve one `Database` to many clients over a TCP or Unix socket.
+
+    Requests are `{"method": ..., ...}` messages answered with `{"result": ...}` or `{"error": ...}`. They run one at
+    a time on the event loop, so clients share the loaded tables and indexes. A transaction belongs to the connection
+    that began it, requests of other connections wait until it is committed or rolled back.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.lock = asyncio.Lock()
+        self.owner = None
+        self.methods = {
+            'run_query': self.run_query,
+            'execute': self.execute,
+            'insert_many': self.insert_many,
+            'next_value': self.next_value,
+            'begin': self.begin,
+            'commit': self.commit,
+            'rollback': self.rollback,
+            'metrics': self.metrics,
+        }
+
+    async def handle(self, reader, writer):
+        connection = object()
+        try:
+            while (message := await read_frame(reader)) is not None:
+                writer.write(encode_frame(await self.dispatch(connection, message)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, RuntimeError, ValueError) as e:
+            print(f"Closing connection: {e!r}")
+        finally:
+            if self.owner is connection:
+                self.db.rollback()
+                self.release()
+            writer.close()
+
+    async def dispatch(self, connection, message):
+        try:
+            method = self.methods[message.get('method')]
+        except KeyError:
+            return {'error': f'Unknown method {message.get("method")}'}
+        try:
+            if self.owner is connection or method == self.begin:
+                return {'result': await method(connection, message)}
+            async with self.lock:
+                return {'result': await method(connection, message)}
+        except Exception as e:
+            return {'error': str(e)}
+
+    async def run_query(self, connection, message):
+        return self.db.run_query(message['query'])
+
+    async def execute(self, connection, message):
+        return self.db.prepare(message['query']).execute(*message.get('parameters', []))
+
+    async def insert_many(self, connection, message):
+        return self.db.insert_many(message['table'], message['rows'])
+
+    async def next_value(self, connection, message):
+        return self.db.next_value(message['table'], message['field'], message.get('step', 1))
+
+    async def begin(self, connection, message):
+        if self.owner is connection:
+            raise RuntimeError('A transaction is already in progress.')
+        # keep holding the lock of this request until the transaction ends
+        await self.lock.acquire()
+        self.owner = connection
+        try:
+            self.db.begin()
+        except Exception:
+            self.release()
+            raise
+
+    async def commit(self, connection, message):
+        self.end_transaction(connection)
+        try:
+            self.db.commit()
+        finally:
+            self.release()
+
+    async def rollback(self, connection, message):
+        self.end_transaction(connection)
+        try:
+            self.db.rollback()
+        finally:
+            self.release()
+
+    async def metrics(self, connection, message):
+        return self.db.metrics.snapshot()
+
+    def end_transaction(self, connection):
+        if self.owner is not connection:
+            raise RuntimeError('No transaction in progress.')
+
+    def release(self):
+        self.owner = None
+        self.lock.release()
+
+
+async def serve(db, host='127.0.0.1', port=7000, unix_path=None):
+    server = Server(db)
+    if unix_path is not None:
+        listener = await asyncio.start_unix_server(server.handle, unix_path)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+    print(f"Serving on {', '.join(str(s.getsockname()) for s in listener.sockets)}")
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a database to clients over a TCP or Unix socket.')
+    parser.add_argument('--schema', default='schema.txt')
+    parser.add_argument('--storage', default='db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7000)
+    parser.add_argument('--unix', help='listen on this Unix socket path instead of TCP')
+    parser.add_argument('--result-cache-size', type=int, default=1024)
+    parser.add_argument('--load-workers', type=int, default=0)
+    args = parser.parse_args()
+
+    db = Database(args.schema, args.storage, result_cache_size=args.result_cache_size, load_workers=args.load_workers)
+    try:
+        asyncio.run(serve(db, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
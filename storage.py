@@ -0,0 +1,472 @@
+import io
+import os
+import csv
+import sys
+import mmap
+import shutil
+import struct
+import argparse
+from itertools import islice
+from collections.abc import MutableMapping
+
+
+def make_directories(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+
+def decode_records(fields, positions, width, records, path):
+    """Columns of csv `records`, each decoded with a single call to the codec of its field.
+
+    A field without a position is missing from the file and filled with its default.
+    """
+    if any(len(values) != width for values in records):
+        raise RuntimeError(f"Invalid record in {path}")
+    columns = list(zip(*records))
+    return [
+        field.decode_column(columns[position]) if position is not None else [field.default] * len(records)
+        for field, position in zip(fields.values(), positions)
+    ]
+
+
+def read_chunk(path, fields, positions, width, start, end):
+    """Decoded columns of the records between the byte offsets `start` and `end` of a csv file, run in a worker."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        chunk = f.read(end - start)
+    records = list(csv.reader(io.TextIOWrapper(io.BytesIO(chunk), newline='')))
+    return decode_records(fields, positions, width, records, path) if records else None
+
+
+class Rows(dict):
+    """Row tuples of a table keyed by id."""
+
+    def __init__(self, columns):
+        super().__init__()
+        self.columns = columns
+
+    def column(self, name):
+        offset = self.columns[name]
+        return ((item_id, item[offset]) for item_id, item in self.items())
+
+
+class CsvStorage:
+    extension = 'db'
+    CHUNK_ROWS = 65536
+
+    def __init__(self, path, fields, id_key):
+        self.path = path
+        self.fields = fields
+        self.id_key = id_key
+        self.columns = {name: offset for offset, name in enumerate(fields)}
+
+    def rows(self):
+        return Rows(self.columns)
+
+    def create(self):
+        make_directories(self.path)
+        with open(self.path, 'w+', newline='') as f:
+            csv.writer(f).writerow(self.fields.keys())
+
+    def read(self):
+        data = self.rows()
+        if not os.path.exists(self.path):
+            self.create()
+            return data
+        with open(self.path, 'r', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            if (positions := self.positions(header)) is None:
+                self.create()
+                return data
+            while records := list(islice(reader, self.CHUNK_ROWS)):
+                self.add_columns(data, decode_records(self.fields, positions, len(header), records, self.path))
+        return data
+
+    def positions(self, header):
+        """Position of every field in the header of the file, None if the file does not match the fields.
+
+        Fields with a default, added to the schema after the file was written, may be missing.
+        """
+        missing = self.fields.keys() - set(header)
+        if not set(header) <= self.fields.keys() or any(self.fields[name].default is None for name in missing):
+            return None
+        return [header.index(name) if name in header else None for name in self.fields]
+
+    def add_columns(self, data, columns):
+        size = len(data)
+        data.update(zip(columns[self.columns[self.id_key]], zip(*columns)))
+        if len(data) != size + len(columns[0]):
+            raise RuntimeError(f"Duplicate id in {self.path}")
+
+    def chunks(self, chunk_bytes):
+        """Positions of the fields in the header, its width and byte ranges of about `chunk_bytes` of whole records.
+
+        Quoted values may contain line breaks, so a range only ends at a line break preceded by an even number of
+        quotes (escaped quotes are doubled and keep the count even). Returns None when the file has to be created.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            header = next(csv.reader([f.readline().decode()]), [])
+            if (positions := self.positions(header)) is None:
+                return None
+            ranges = []
+            start = f.tell()
+            while block := f.read(chunk_bytes):
+                quotes = block.count(b'"')
+                while quotes % 2 or not block.endswith(b'\n'):
+                    if not (line := f.readline()):
+                        break
+                    quotes += line.count(b'"')
+                    block = line
+                ranges.append((start, f.tell()))
+                start = f.tell()
+        return positions, len(header), ranges
+
+    def read_parallel(self, executor, chunk_bytes):
+        """Start decoding the file in the worker processes of `executor`, returns a function giving the rows."""
+        chunks = self.chunks(chunk_bytes)
+        if chunks is None:
+            return self.read
+        positions, width, ranges = chunks
+        futures = [
+            executor.submit(read_chunk, self.path, self.fields, positions, width, start, end) for start, end in ranges
+        ]
+
+        def result():
+            data = self.rows()
+            for future in futures:
+                if (columns := future.result()) is not None:
+                    self.add_columns(data, columns)
+            return data
+
+        return result
+
+    def write(self, data):
+        """Replace the file with the rows of `data`, returns the rows to keep using."""
+        make_directories(self.path)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w+', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.fields.keys())
+            writer.writerows(data.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        return data
+
+    def close(self):
+        pass
+
+
+class BinaryStorage:
+    """Fixed width records memory-mapped from a `.bin` file.
+
+    The file is a header (magic, field count, row count, heap offset), the field descriptors, the records sorted by
+    id and a heap. Integers take 8 bytes and booleans 1 byte inside the record; CHAR and TIMESTAMP values are stored
+    in the heap and referenced from the record by offset and length, so every record has the same width and record
+    `n` is found without reading the ones before it.
+    """
+    extension = 'bin'
+    MAGIC = b'APDB'
+    HEADER = struct.Struct('<4sIQQ')
+    STRING = 'QH'
+
+    def __init__(self, path, fields, id_key):
+        self.path = path
+        self.fields = fields
+        self.id_key = id_key
+        self.columns = {name: offset for offset, name in enumerate(fields)}
+        self.formats = {name: field.binary_format() for name, field in fields.items()}
+        self.record = struct.Struct('<' + ''.join(self.formats.values()))
+        self.field_structs = {}
+        offset = 0
+        for name, field_format in self.formats.items():
+            field_struct = struct.Struct('<' + field_format)
+            self.field_structs[name] = (offset, field_struct)
+            offset += field_struct.size
+        self.file = None
+        self.map = None
+        self.count = 0
+        self.records_offset = 0
+        self.heap_offset = 0
+
+    def descriptors(self):
+        descriptor = b''
+        for name, field in self.fields.items():
+            for text in [name, field.type]:
+                encoded = text.encode()
+                descriptor += struct.pack('<B', len(encoded)) + encoded
+        return descriptor
+
+    def rows(self):
+        return Rows(self.columns)
+
+    def read(self):
+        self.close()
+        if not os.path.exists(self.path):
+            self.write(self.rows())
+        self.file = open(self.path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, field_count, self.count, self.heap_offset = self.HEADER.unpack_from(self.map, 0)
+        descriptors = self.descriptors()
+        self.records_offset = self.HEADER.size + len(descriptors)
+        if magic != self.MAGIC or self.map[self.HEADER.size:self.records_offset] != descriptors:
+            raise RuntimeError(f"{self.path} does not match the schema, convert the table again.")
+        return BinaryRows(self)
+
+    def read_parallel(self, executor, chunk_bytes):
+        """Records are decoded on access from the memory map, there is nothing to read ahead of time."""
+        return self.read
+
+    def write(self, data):
+        """Replace the file with the rows of `data`, returns the rows to keep using."""
+        make_directories(self.path)
+        temp_path = self.path + '.tmp'
+        heap_path = self.path + '.heap'
+        descriptors = self.descriptors()
+        heap_size = 0
+        count = 0
+        with open(temp_path, 'wb') as f, open(heap_path, 'wb+') as heap:
+            f.write(self.HEADER.pack(self.MAGIC, len(self.fields), 0, 0) + descriptors)
+            id_offset = self.columns[self.id_key]
+            encoders = [field.encode for field in self.fields.values()]
+            for item in sorted(data.values(), key=lambda item: item[id_offset]):
+                values = []
+                for field_format, encode, value in zip(self.formats.values(), encoders, item):
+                    if field_format == self.STRING:
+                        encoded = encode(value).encode()
+                        heap.write(encoded)
+                        values += [heap_size, len(encoded)]
+                        heap_size += len(encoded)
+                    else:
+                        values.append(value)
+                f.write(self.record.pack(*values))
+                count += 1
+            heap_offset = f.tell()
+            heap.seek(0)
+            shutil.copyfileobj(heap, f)
+            f.seek(0)
+            f.write(self.HEADER.pack(self.MAGIC, len(self.fields), count, heap_offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(heap_path)
+        was_open = self.map is not None
+        self.close()
+        os.replace(temp_path, self.path)
+        if was_open:
+            return self.read()
+        return data
+
+    def record_offset(self, position):
+        return self.records_offset + position * self.record.size
+
+    def decode_field(self, position, name):
+        offset, field_struct = self.field_structs[name]
+        values = field_struct.unpack_from(self.map, self.record_offset(position) + offset)
+        if self.formats[name] == self.STRING:
+            start = self.heap_offset + values[0]
+            return self.map[start:start + values[1]].decode()
+        return values[0]
+
+    def decode(self, position):
+        values = iter(self.record.unpack_from(self.map, self.record_offset(position)))
+        item = []
+        for field_format in self.formats.values():
+            if field_format == self.STRING:
+                start = self.heap_offset + next(values)
+                item.append(self.map[start:start + next(values)].decode())
+            else:
+                item.append(next(values))
+        return tuple(item)
+
+    def column(self, name):
+        """(id, value) of every record, unpacking the records in bulk."""
+        id_index = self.value_index(self.id_key)
+        value_index = self.value_index(name)
+        records = memoryview(self.map)[self.records_offset:self.record_offset(self.count)]
+        is_string = self.formats[name] == self.STRING
+        for values in self.record.iter_unpack(records):
+            if is_string:
+                start = self.heap_offset + values[value_index]
+                yield values[id_index], self.map[start:start + values[value_index + 1]].decode()
+            else:
+                yield values[id_index], values[value_index]
+        records.release()
+
+    def value_index(self, name):
+        """Position of the first value of a field in an unpacked record."""
+        index = 0
+        for field_name, field_format in self.formats.items():
+            if field_name == name:
+                return index
+            index += len(field_format)
+
+    def id_at(self, position):
+        return self.decode_field(position, self.id_key)
+
+    def position(self, item_id):
+        """Binary search of the record holding `item_id`, records are written in id order."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.id_at(middle) < item_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.id_at(low) == item_id:
+            return low
+        return None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = None
+            self.file = None
+
+
+class BinaryRows(MutableMapping):
+    """Rows of a binary table, records are decoded from the mapped file on first access.
+
+    Rows added or changed after the snapshot was written, and every row handed out once, are kept in `rows`; `deleted`
+    holds the ids removed from the snapshot.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.rows = {}
+        self.added = {}
+        self.deleted = set()
+        self.length = storage.count
+
+    def __getitem__(self, item_id):
+        if item_id in self.rows:
+            return self.rows[item_id]
+        if item_id in self.deleted or (position := self.storage.position(item_id)) is None:
+            raise KeyError(item_id)
+        item = self.rows[item_id] = self.storage.decode(position)
+        return item
+
+    def __setitem__(self, item_id, item):
+        if item_id not in self:
+            self.length += 1
+            if item_id in self.deleted:
+                self.deleted.discard(item_id)
+            else:
+                self.added[item_id] = None
+        self.rows[item_id] = item
+
+    def __delitem__(self, item_id):
+        if item_id not in self:
+            raise KeyError(item_id)
+        self.rows.pop(item_id, None)
+        self.length -= 1
+        if item_id in self.added:
+            del self.added[item_id]
+        else:
+            self.deleted.add(item_id)
+
+    def __contains__(self, item_id):
+        if item_id in self.rows:
+            return True
+        return item_id not in self.deleted and self.storage.position(item_id) is not None
+
+    def __len__(self):
+        return self.length
+
+    def snapshot_ids(self):
+        for position, (item_id, value) in enumerate(self.storage.column(self.storage.id_key)):
+            if item_id not in self.deleted:
+                yield position, item_id
+
+    def __iter__(self):
+        for position, item_id in self.snapshot_ids():
+            yield item_id
+        yield from list(self.added)
+
+    def items(self):
+        for position, item_id in self.snapshot_ids():
+            if item_id not in self.rows:
+                self.rows[item_id] = self.storage.decode(position)
+            yield item_id, self.rows[item_id]
+        for item_id in list(self.added):
+            yield item_id, self.rows[item_id]
+
+    def values(self):
+        return (item for item_id, item in self.items())
+
+    def column(self, name):
+        """(id, value) pairs of one column, without building the rows."""
+        offset = self.storage.columns[name]
+        for item_id, value in self.storage.column(name):
+            if item_id in self.rows:
+                yield item_id, self.rows[item_id][offset]
+            elif item_id not in self.deleted:
+                yield item_id, value
+        for item_id in list(self.added):
+            yield item_id, self.rows[item_id][offset]
+
+
+STORAGE_ENGINES = {
+    'csv': CsvStorage,
+    'binary': BinaryStorage,
+}
+
+
+def convert(database, table_name, target):
+    """Rewrite a table with another storage engine.
+
+    The table must already be declared with the target engine in the schema, which is what it is read with on the
+    next start. The newest snapshot is loaded with its write-ahead log and written with the target engine, then the
+    log is emptied and the old snapshot removed, so a table never has two snapshots that could disagree.
+    """
+    from database import Table
+
+    table = database.schema[table_name]
+    if not isinstance(table.storage, STORAGE_ENGINES[target]):
+        raise RuntimeError(f'Declare table {table_name} as `{table_name} {target}` in the schema before converting it.')
+    if table.loaded:
+        raise RuntimeError(f'Table {table_name} is in use, convert it before it is read.')
+    base_path = os.path.splitext(table.path)[0]
+    snapshots = [
+        (name, engine, f'{base_path}.{engine.extension}') for name, engine in STORAGE_ENGINES.items()
+        if os.path.exists(f'{base_path}.{engine.extension}')
+    ]
+    if not snapshots:
+        raise RuntimeError(f'No snapshot found for table {table_name}')
+    name, engine, path = max(snapshots, key=lambda snapshot: os.path.getmtime(snapshot[2]))
+    if name == target:
+        raise RuntimeError(f'Table {table_name} is already stored as {target}')
+
+    source = Table(path, list(table.fields.values()), engine, database.metrics)
+    source.load()
+    destination = STORAGE_ENGINES[target](f'{base_path}.{STORAGE_ENGINES[target].extension}', table.fields,
+                                          table.id_key)
+    destination.write(source.data)
+    destination.close()
+    source.write_sequences()
+    source.close()
+    open(source.log_path, 'w').close()
+    os.remove(path)
+    print(f"Converted {path} to {destination.path}, {len(source.data)} records")
+
+
+if __name__ == '__main__':
+    from database import Database
+
+    parser = argparse.ArgumentParser(
+        description='Convert table snapshots to the storage engine they are declared with in the schema.')
+    parser.add_argument('tables', nargs='+')
+    parser.add_argument('--to', choices=STORAGE_ENGINES.keys(), default='binary')
+    parser.add_argument('--schema', default='schema.txt')
+    parser.add_argument('--storage', default='db')
+    args = parser.parse_args()
+
+    db = Database(args.schema, args.storage)
+    for name in args.tables:
+        if name not in db.schema:
+            sys.exit(f'Table {name} does not exists.')
+        convert(db, name, args.to)
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+SCHEMA = '''accounts{storage}
+id ID
+owner INDEX INTEGER
+amount SORTED INTEGER
+note CHAR(100)
+'''
+
+
+def write_schema(directory, storage=''):
+    path = os.path.join(directory, f'schema{storage}.txt')
+    with open(path, 'w') as f:
+        f.write(SCHEMA.format(storage=f' {storage}' if storage else ''))
+    return path
+
+
+def rows(db, table_name='accounts'):
+    return {row['id']: dict(row) for row in db.run_query(f'select from {table_name};')}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return str(tmp_path / 'db')
+
+
+@pytest.fixture
+def open_db(tmp_path, storage):
+    """Opens databases on the same storage, like restarts of the process, and closes those still open at the end."""
+    opened = []
+
+    def open_db(storage_engine='', **options):
+        db = Database(write_schema(str(tmp_path), storage_engine), storage, **options)
+        opened.append(db)
+        return db
+
+    yield open_db
+    for db in opened:
+        db.close()
@@ -0,0 +1,38 @@
+import pytest
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+@pytest.fixture
+def db(open_db):
+    db = open_db()
+    for owner, amount in [(1, 10), (1, 20), (2, 5)]:
+        db.prepare(INSERT).execute(owner, amount, 'a')
+    return db
+
+
+def result(db, query):
+    return [dict(row) for row in db.run_query(query)]
+
+
+def test_aggregates_of_the_whole_table(db):
+    assert result(db, 'select count(*), sum(amount), min(amount), max(amount) from accounts;') == [
+        {'count(*)': 3, 'sum(amount)': 35, 'min(amount)': 5, 'max(amount)': 20}]
+
+
+def test_aggregates_of_no_rows(db):
+    assert result(db, 'select count(*), max(amount) from accounts where owner == 3;') == [
+        {'count(*)': 0, 'max(amount)': None}]
+
+
+def test_group_by(db):
+    assert result(db, 'select owner, count(*) as n, sum(amount) from accounts group by owner;') == [
+        {'owner': 1, 'n': 2, 'sum(amount)': 30}, {'owner': 2, 'n': 1, 'sum(amount)': 5}]
+    assert result(db, 'select owner, sum(amount) from accounts group by owner order by owner desc limit 1;') == [
+        {'owner': 2, 'sum(amount)': 5}]
+
+
+def test_min_and_max_follow_writes(db):
+    db.run_query('delete from accounts where amount == 5;')
+    db.prepare(INSERT).execute(3, 50, 'a')
+    assert result(db, 'select min(amount), max(amount) from accounts;') == [{'min(amount)': 10, 'max(amount)': 50}]
@@ -0,0 +1,64 @@
+import pytest
+
+from database import ResultCache
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+@pytest.fixture
+def db(open_db):
+    db = open_db(result_cache_size=16)
+    db.prepare(INSERT).execute(1, 10, 'a')
+    return db
+
+
+def amounts(db, owner=1):
+    return [row['amount'] for row in db.prepare('select from accounts where owner == ?;').execute(owner)]
+
+
+def test_repeated_selects_hit_the_cache(db):
+    assert amounts(db) == amounts(db) == [10]
+    assert amounts(db, 2) == []
+    stats = db.result_cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 2, 2)
+
+
+@pytest.mark.parametrize('write', [
+    lambda db: db.prepare(INSERT).execute(1, 20, 'b'),
+    lambda db: db.run_query('update accounts set amount = 20 where id == 1;'),
+    lambda db: db.run_query('update accounts set amount = amount + 10, owner = 1 where note == a;'),
+    lambda db: db.run_query('delete from accounts where id == 1;'),
+    lambda db: db.insert_many('accounts', [{'owner': 1, 'amount': 20, 'note': 'b'}]),
+])
+def test_writes_invalidate_the_results_of_their_table(db, write):
+    before = amounts(db)
+    write(db)
+    after = [row['amount'] for row in db.run_query('select from accounts where owner == 1;')]
+    assert amounts(db) == after != before
+    assert db.result_cache.stats()['invalidations'] >= 1
+
+
+def test_rollback_invalidates_results_read_inside_the_transaction(db):
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.run_query('update accounts set amount = 99 where id == 1;')
+            assert amounts(db) == [99]
+            raise RuntimeError('abort')
+    assert amounts(db) == [10]
+
+
+def test_hits_hand_out_new_row_views(db):
+    row = db.prepare('select from accounts where owner == ?;').execute(1)[0]
+    row['amount'] = 500
+    assert amounts(db) == [10]
+
+
+def test_cache_is_bounded_and_invalidated_per_table():
+    cache = ResultCache(2)
+    cache.put('a', 1, 'one')
+    cache.put('b', 2, 'two')
+    cache.put('a', 3, 'three')
+    assert cache.get(1) is None
+    cache.invalidate('a')
+    assert (cache.get(2), cache.get(3)) == ('two', None)
+    assert cache.stats()['evictions'] == cache.stats()['invalidations'] == 1
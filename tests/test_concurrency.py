@@ -0,0 +1,84 @@
+import os
+import threading
+
+import pytest
+
+from database import Database
+
+models = pytest.importorskip('models')
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema.txt')
+
+
+@pytest.fixture
+def accounts(storage):
+    db = Database(SCHEMA, storage)
+    user = models.User(db)
+    user.id = 1
+    model = models.Account(user)
+    for amount in [1000, 1000, 1000]:
+        model.amount = amount
+        model.password = 'secret'
+        model.alias = 'alias'
+        model.open_account()
+    yield model
+    db.close()
+
+
+def balances(model):
+    return [row['amount'] for row in model.all()]
+
+
+def test_stale_write_raises_conflict(accounts):
+    row = accounts.first_by('id', 1)
+    accounts.compare_and_set(row, {'amount': 900})
+    with pytest.raises(models.Conflict):
+        accounts.compare_and_set(row, {'amount': 800})
+    assert accounts.first_by('id', 1)['amount'] == 900
+
+
+def test_transfer_retries_after_a_conflict(accounts, monkeypatch):
+    first_by = accounts.first_by
+    interfered = []
+
+    def first_by_then_interfere(field, value):
+        row = first_by(field, value)
+        if not interfered:
+            # another transaction deposits into the source between the read and the write
+            interfered.append(row['version'])
+            accounts.compare_and_set(row, {'amount': row['amount'] + 50})
+        return row
+
+    monkeypatch.setattr(accounts, 'first_by', first_by_then_interfere)
+    accounts.transfer({'id': 1}, {'id': 2}, 100)
+    assert balances(accounts) == [950, 1100, 1000]
+    assert accounts.first_by('id', 1)['version'] == interfered[0] + 2
+
+
+def test_retry_gives_up_after_the_last_conflict(monkeypatch):
+    monkeypatch.setattr(models.time, 'sleep', lambda seconds: None)
+    attempts = []
+
+    def conflicting():
+        attempts.append(None)
+        raise models.Conflict('changed')
+
+    with pytest.raises(models.Conflict):
+        models.BaseModel.retry(conflicting, retries=3)
+    assert len(attempts) == 3
+
+
+def test_concurrent_transfers_keep_every_deposit(accounts):
+    def transfer(source, destination):
+        for _ in range(20):
+            accounts.transfer({'id': source}, {'id': destination}, 10)
+
+    threads = [threading.Thread(target=transfer, args=pair) for pair in [(1, 2), (2, 3), (3, 1), (1, 3)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert balances(accounts) == [800, 1000, 1200]
+    transfers = accounts.db_connection.run_query(
+        'select count(*) from transactions where description == "Transfer money";')
+    assert transfers[0]['count(*)'] == 80
@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from database import compile_condition
+from query import Parser
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+@pytest.fixture
+def accounts(open_db):
+    db = open_db()
+    rng = random.Random(0)
+    for owner in range(200):
+        db.prepare(INSERT).execute(rng.randrange(10), rng.randrange(100), rng.choice(['a', 'b']))
+    return db.get_table('accounts')
+
+
+def compile_where(table, where):
+    return compile_condition(table, Parser(f'select from accounts where {where};').parse().where)
+
+
+@pytest.mark.parametrize('where, indexed', [
+    ('owner == 3', True),
+    ('note == a', False),
+    ('owner == 3 and note == a', True),
+    ('owner == 3 or owner == 4', True),
+    ('owner == 3 or note == a', False),
+    ('(owner == 3 or owner == 4) and amount < 50', True),
+    ('owner == 3 and amount >= 20 and amount <= 70', True),
+    ('amount > 90 or owner == 1 and note == b', True),
+    ('note == a and (amount between 10 and 20 or owner != 2)', False),
+])
+def test_index_lookups_match_the_predicate(accounts, where, indexed):
+    condition = compile_where(accounts, where)
+    scanned = {item_id for item_id, item in accounts.data.items() if condition.predicate(item)}
+    assert scanned
+    assert (condition.lookup is not None) == indexed
+    if indexed:
+        assert set(condition.lookup()) == scanned
+
+
+def test_predicates_short_circuit(accounts):
+    columns = accounts.columns
+    checked = []
+
+    class Watched(tuple):
+        def __getitem__(self, offset):
+            checked.append(offset)
+            return tuple.__getitem__(self, offset)
+
+    condition = compile_where(accounts, 'owner == 3 and note == a or amount < 0')
+    item = next(item for item in accounts.data.values() if item[columns['owner']] != 3)
+    # the AND stops at its first false condition without reading `note`, the OR goes on with the next branch
+    assert not condition.predicate(Watched(item))
+    assert checked == [columns['owner'], columns['amount']]
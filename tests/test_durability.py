@@ -0,0 +1,53 @@
+import os
+import threading
+
+from conftest import rows
+from database import Durability
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+def read(path):
+    with open(path, newline='') as f:
+        return f.read()
+
+
+def test_async_commit_reaches_the_table_log_only_after_the_journal_fsync(open_db, storage):
+    db = open_db(durability=Durability.ASYNC, group_commit_ms=60000)
+    db.prepare(INSERT).execute(1, 100, 'a')
+    log_path = os.path.join(storage, 'accounts.log')
+    assert not os.path.exists(log_path) or read(log_path) == ''
+    db.journal.fsync()
+    assert read(log_path).startswith('insert,1,1,100,a')
+
+
+def test_async_commits_are_flushed_on_close(open_db):
+    db = open_db(durability=Durability.ASYNC, group_commit_ms=60000)
+    for owner in range(1, 4):
+        db.prepare(INSERT).execute(owner, 100, 'a')
+    db.close()
+    assert sorted(rows(open_db())) == [1, 2, 3]
+
+
+def test_group_commits_share_fsyncs(open_db):
+    db = open_db(durability=Durability.GROUP, group_commit_ms=20)
+
+    def commit(owner):
+        db.prepare(INSERT).execute(owner, 100, 'a')
+
+    threads = [threading.Thread(target=commit, args=(owner,)) for owner in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every commit has returned, so it is durable
+    assert db.journal.durable == db.journal.written == 8
+    assert db.metrics.snapshot()['counters']['fsyncs']['journal'] < 8
+    assert sorted(rows(open_db())) == list(range(1, 9))
+
+
+def test_transaction_durability_overrides_the_database(open_db, storage):
+    db = open_db(durability=Durability.ASYNC, group_commit_ms=60000)
+    with db.transaction(Durability.SYNC):
+        db.prepare(INSERT).execute(1, 100, 'a')
+    assert read(os.path.join(storage, 'accounts.log')).startswith('insert,1,1,100,a')
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from conftest import rows
+from importer import import_file
+
+
+def test_insert_many_is_one_atomic_batch(open_db):
+    db = open_db()
+    inserted = db.insert_many('accounts', [{'owner': owner, 'amount': 10, 'note': 'a'} for owner in range(1, 4)])
+    assert [row['id'] for row in inserted] == [1, 2, 3]
+    with pytest.raises(RuntimeError, match='duplicate'):
+        db.insert_many('accounts', [{'id': 7, 'owner': 1, 'amount': 1, 'note': 'b'},
+                                    {'id': 7, 'owner': 2, 'amount': 2, 'note': 'c'}])
+    with pytest.raises(RuntimeError, match='without column'):
+        db.insert_many('accounts', [{'owner': 1, 'amount': 1, 'note': 'b'}, {'owner': 2}])
+    assert sorted(rows(db)) == [1, 2, 3]
+    assert sorted(rows(open_db())) == [1, 2, 3]
+
+
+def test_import_csv_and_jsonl_in_chunks(open_db, tmp_path):
+    csv_path = tmp_path / 'accounts.csv'
+    csv_path.write_text('owner,amount,note\n1,10,"a, b"\n2,20,c\n3,30,d\n')
+    jsonl_path = tmp_path / 'accounts.jsonl'
+    jsonl_path.write_text('\n'.join(json.dumps({'owner': 4, 'amount': amount, 'note': 'e'}) for amount in [40, 50]))
+    db = open_db()
+    assert import_file(db, 'accounts', str(csv_path), chunk_size=2) == 3
+    assert import_file(db, 'accounts', str(jsonl_path), chunk_size=2) == 2
+    assert [(row['owner'], row['amount'], row['note']) for row in rows(open_db()).values()] == [
+        (1, 10, 'a, b'), (2, 20, 'c'), (3, 30, 'd'), (4, 40, 'e'), (4, 50, 'e')]
+    with pytest.raises(RuntimeError, match='Unsupported file type'):
+        import_file(db, 'accounts', str(tmp_path / 'accounts.xml'))
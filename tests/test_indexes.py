@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from database import SortedIndex
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+def test_sorted_index_matches_a_sorted_list(monkeypatch):
+    monkeypatch.setattr(SortedIndex, 'CHUNK', 4)
+    rng = random.Random(0)
+    index = SortedIndex('amount')
+    pairs = [(item_id, rng.randrange(30)) for item_id in range(20)]
+    index.build(pairs)
+    entries = sorted((value, item_id) for item_id, value in pairs)
+    for item_id in range(20, 300):
+        if rng.random() < 0.4:
+            value, removed = entries.pop(rng.randrange(len(entries)))
+            index.remove(value, removed)
+        else:
+            value = rng.randrange(30)
+            index.add(value, item_id)
+            entries.append((value, item_id))
+            entries.sort()
+        assert list(index) == entries
+        assert list(reversed(index)) == entries[::-1]
+        assert all(0 < len(chunk) <= 2 * SortedIndex.CHUNK for chunk in index.chunks)
+    assert index.lookup(7) == [item_id for value, item_id in entries if value == 7]
+    assert index.range(5, 10, include_low=False) == [item_id for value, item_id in entries if 5 < value <= 10]
+    assert index.range(high=3, include_high=False) == [item_id for value, item_id in entries if value < 3]
+    assert index.range(low=28) == [item_id for value, item_id in entries if value >= 28]
+
+
+@pytest.mark.parametrize('where, check', [
+    ('amount < 10', lambda amount: amount < 10),
+    ('amount <= 10', lambda amount: amount <= 10),
+    ('amount > 90', lambda amount: amount > 90),
+    ('amount >= 90', lambda amount: amount >= 90),
+    ('amount between 20 and 25', lambda amount: 20 <= amount <= 25),
+    ('amount > 20 and amount < 25', lambda amount: 20 < amount < 25),
+])
+def test_range_queries_read_only_the_matching_rows(open_db, where, check):
+    db = open_db()
+    rng = random.Random(0)
+    for owner in range(300):
+        db.prepare(INSERT).execute(owner, rng.randrange(100), 'a')
+    db.run_query('delete from accounts where amount == 22;')
+    db.run_query('update accounts set amount = 24 where amount == 50;')
+    scanned = db.metrics.snapshot()['counters']['rows_scanned']['accounts']
+    found = [row['id'] for row in db.run_query(f'select from accounts where {where};')]
+    assert db.metrics.snapshot()['counters']['rows_scanned']['accounts'] - scanned == len(found)
+    assert found == [row['id'] for row in db.run_query('select from accounts;') if check(row['amount'])]
+
+
+def test_between_binds_parameters(open_db):
+    db = open_db()
+    for amount in range(10):
+        db.prepare(INSERT).execute(1, amount, 'a')
+    between = db.prepare('select from accounts where amount between ? and ?;')
+    assert [row['amount'] for row in between.execute(3, 5)] == [3, 4, 5]
+    assert [row['amount'] for row in between.execute(8, 20)] == [8, 9]
@@ -0,0 +1,36 @@
+from conftest import rows
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+def test_tables_are_loaded_on_first_use(open_db):
+    db = open_db()
+    db.prepare(INSERT).execute(1, 100, 'a')
+    db.close()
+    db = open_db()
+    assert not db.schema['accounts'].loaded
+    assert list(rows(db)) == [1]
+    assert db.schema['accounts'].loaded
+
+
+def test_parallel_load_splits_only_between_records(open_db):
+    db = open_db()
+    for owner in range(1, 101):
+        note = 'line one\nline "two",\n3' if owner % 3 else 'plain'
+        db.prepare(INSERT).execute(owner, owner, note)
+    db.checkpoint()
+    expected = rows(db)
+    db.close()
+    for chunk_bytes in [1, 7, 64, 1 << 20]:
+        loaded = open_db()
+        loaded.load_tables(2, chunk_bytes=chunk_bytes)
+        assert rows(loaded) == expected
+
+
+def test_load_workers_load_every_table_at_startup(open_db):
+    db = open_db()
+    db.prepare(INSERT).execute(1, 100, 'a')
+    db.close()
+    db = open_db(load_workers=2)
+    assert db.schema['accounts'].loaded
+    assert list(rows(db)) == [1]
@@ -0,0 +1,118 @@
+import time
+import threading
+
+import pytest
+
+from database import TableLock
+
+
+def in_thread(function):
+    """Run `function` in another thread, returns the exception it raised or None."""
+    result = []
+
+    def run():
+        try:
+            function()
+            result.append(None)
+        except RuntimeError as e:
+            result.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+@pytest.fixture
+def lock():
+    return TableLock('accounts', timeout=0.05)
+
+
+def test_readers_share_the_table(lock):
+    lock.acquire_read()
+    assert in_thread(lambda: (lock.acquire_read(), lock.release_read())) is None
+    lock.release_read()
+
+
+def test_writer_excludes_readers_and_writers(lock):
+    lock.acquire_write()
+    assert 'read lock' in str(in_thread(lock.acquire_read))
+    assert 'write lock' in str(in_thread(lock.acquire_write))
+    assert 'write lock' in str(in_thread(lock.acquire_intent))
+    lock.release_write()
+    assert in_thread(lambda: (lock.acquire_read(), lock.release_read())) is None
+
+
+def test_locks_are_reentrant_for_their_thread(lock):
+    lock.acquire_write()
+    lock.acquire_write()
+    lock.acquire_read()
+    lock.acquire_intent()
+    lock.release_intent()
+    lock.release_read()
+    lock.release_write()
+    assert 'read lock' in str(in_thread(lock.acquire_read))
+    lock.release_write()
+    assert in_thread(lambda: (lock.acquire_write(), lock.release_write())) is None
+
+
+def test_row_writers_share_the_table_but_not_their_rows(lock):
+    lock.acquire_intent()
+    assert lock.acquire_rows([1, 2]) == [1, 2]
+    assert lock.acquire_rows([2, 3]) == [3]
+
+    def other_writer(data_ids):
+        def write():
+            lock.acquire_intent()
+            try:
+                lock.release_rows(lock.acquire_rows(data_ids))
+            finally:
+                lock.release_intent()
+        return write
+
+    assert in_thread(other_writer([4, 5])) is None
+    assert 'row lock' in str(in_thread(other_writer([3, 4])))
+    assert 'read lock' in str(in_thread(lock.acquire_read))
+    lock.release_rows([1, 2, 3])
+    assert in_thread(other_writer([3, 4])) is None
+    lock.release_intent()
+
+
+def test_row_writer_reads_ahead_of_a_waiting_writer(lock):
+    lock.timeout = 5
+    lock.acquire_intent()
+    acquired = threading.Event()
+
+    def writer():
+        lock.acquire_write()
+        acquired.set()
+        lock.release_write()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while not lock.waiting_writers:
+        time.sleep(0.001)
+    lock.timeout = 0.05
+    lock.acquire_read()
+    lock.release_read()
+    assert not acquired.is_set()
+    lock.timeout = 5
+    lock.release_intent()
+    thread.join()
+    assert acquired.is_set()
+
+
+def test_transaction_selects_while_an_exclusive_update_waits(open_db):
+    db = open_db()
+    db.prepare('insert into accounts (owner, amount, note) values (?, ?, ?);').execute(1, 2, 'a')
+    db.get_table('accounts').lock.timeout = 5
+    with db.transaction():
+        db.run_query('update accounts set amount = 5 where id == 1;')
+        # `note` is not indexed, so this update locks the whole table and waits for the transaction
+        other = threading.Thread(target=lambda: db.run_query('update accounts set amount = 7 where note == a;'))
+        other.start()
+        while not db.get_table('accounts').lock.waiting_writers:
+            time.sleep(0.001)
+        assert db.run_query('select from accounts;')[0]['amount'] == 5
+    other.join()
+    assert db.run_query('select from accounts;')[0]['amount'] == 7
@@ -0,0 +1,45 @@
+import json
+
+from metrics import Metrics
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+def test_queries_are_timed_and_counted_per_statement_and_table(open_db):
+    db = open_db()
+    db.prepare(INSERT).execute(1, 10, 'a')
+    db.prepare(INSERT).execute(2, 20, 'b')
+    db.run_query('select from accounts where owner == 2;')
+    snapshot = db.metrics.snapshot()
+    assert snapshot['latency']['insert']['accounts']['count'] == 2
+    assert snapshot['latency']['select']['accounts']['count'] == 1
+    assert snapshot['counters']['rows_returned']['accounts'] == 1
+    assert snapshot['counters']['rows_scanned']['accounts'] == 1
+    assert snapshot['counters']['fsyncs']['journal'] == 2
+    assert json.loads(db.metrics.dump()) == db.metrics.snapshot()
+
+
+def test_slow_queries_are_logged_with_their_parameters(open_db, tmp_path):
+    log_path = tmp_path / 'slow.log'
+    db = open_db(slow_query_log=str(log_path), slow_query_ms=0)
+    db.prepare('select from accounts where owner == ?;').execute(7)
+    db.metrics.close()
+    assert db.metrics.snapshot()['slow_queries'] == 1
+    assert log_path.read_text().rstrip().endswith('select from accounts where owner == ?; [7]')
+
+
+def test_fast_queries_are_not_logged(tmp_path):
+    metrics = Metrics(str(tmp_path / 'slow.log'), slow_query_ms=100)
+    metrics.query('select from accounts;', (), 5)
+    assert metrics.snapshot()['slow_queries'] == 0
+    assert not (tmp_path / 'slow.log').exists()
+
+
+def test_histogram_buckets():
+    metrics = Metrics()
+    for milliseconds in [0.05, 0.3, 7, 9000]:
+        metrics.observe('select', 'accounts', milliseconds)
+    histogram = metrics.snapshot()['latency']['select']['accounts']
+    assert histogram['count'] == 4 and histogram['max_ms'] == 9000
+    assert {label: count for label, count in histogram['buckets'].items() if count} == {
+        '<=0.1ms': 1, '<=0.5ms': 1, '<=10ms': 1, '>5000ms': 1}
@@ -0,0 +1,45 @@
+import pytest
+
+from conftest import rows
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+def test_parameters_are_values_not_query_text(open_db):
+    db = open_db()
+    note = 'a" or note == "b; delete from accounts'
+    db.prepare(INSERT).execute(1, 10, note)
+    db.prepare(INSERT).execute(2, 20, 'b')
+    assert [row['id'] for row in db.prepare('select from accounts where note == ?;').execute(note)] == [1]
+    assert rows(open_db())[1]['note'] == note
+
+
+def test_statements_are_shared_and_rebound(open_db):
+    db = open_db()
+    select = db.prepare('select from accounts where owner == ?;')
+    assert db.prepare('  select from accounts where owner == ?;  ') is select
+    for owner in range(1, 4):
+        db.prepare(INSERT).execute(owner, owner * 10, 'a')
+    assert [row['amount'] for row in select.execute(2)] == [20]
+    assert [row['amount'] for row in select.execute('3')] == [30]
+    with pytest.raises(RuntimeError, match='takes 1 parameters, 0 given'):
+        select.execute()
+    with pytest.raises(RuntimeError, match='Invalid value'):
+        select.execute('x')
+
+
+def test_models_build_each_query_shape_once(open_db):
+    models = pytest.importorskip('models')
+    db = open_db()
+    first = models.BaseModel(db, 'accounts')
+    first.insert({'owner': 1, 'amount': 10, 'note': 'a'})
+    first.insert({'owner': 2, 'amount': 20, 'note': 'b'})
+    assert first.first_by('owner', 2)['id'] == 2
+    # a model made for the next action reuses the statements of the first one
+    second = models.BaseModel(db, 'accounts')
+    assert second.first_by('owner', 1)['id'] == 1
+    assert [row['id'] for row in second.all([['amount', '>=', 10], ['note', '==', 'b']])] == [2]
+    assert len(second.all()) == 2
+    assert sorted(shape for table, shape in models.BaseModel.statements[db]) == [
+        ('all',), ('all', ('amount', '>='), ('note', '==')), ('first', ('owner', '==')),
+        ('insert', 'owner', 'amount', 'note')]
@@ -0,0 +1,62 @@
+import pytest
+
+from query import Parser, And, Or, Between, Select, Insert, Delete, Parameter
+
+
+def where(query):
+    return describe(Parser(query).parse().where)
+
+
+def describe(node):
+    """A condition as nested tuples, easier to compare than the nodes."""
+    if isinstance(node, (And, Or)):
+        return (type(node).__name__.lower(), *[describe(condition) for condition in node.conditions])
+    if isinstance(node, Between):
+        return 'between', node.field, text(node.low), text(node.high)
+    return node.field, node.operator, text(node.value)
+
+
+def text(value):
+    return f'?{value.index}' if isinstance(value, Parameter) else value
+
+
+def test_and_binds_tighter_than_or():
+    assert where('select from t where a == 1 or b == 2 and c == 3;') == (
+        'or', ('a', '==', '1'), ('and', ('b', '==', '2'), ('c', '==', '3')))
+    assert where('select from t where a == 1 and b == 2 or c == 3;') == (
+        'or', ('and', ('a', '==', '1'), ('b', '==', '2')), ('c', '==', '3'))
+
+
+def test_parentheses_group_conditions():
+    assert where('select from t where (a == 1 or b == 2) and c != 3;') == (
+        'and', ('or', ('a', '==', '1'), ('b', '==', '2')), ('c', '!=', '3'))
+
+
+def test_values_and_parameters():
+    assert where('select from t where name == "a and b" and c >= ? and d between 1 and ?;') == (
+        'and', ('name', '==', 'a and b'), ('c', '>=', '?0'), ('between', 'd', '1', '?1'))
+
+
+def test_statements():
+    select = Parser('SELECT FROM Accounts ORDER BY amount DESC, id LIMIT 5 OFFSET 10;').parse()
+    assert isinstance(select, Select)
+    assert (select.table, select.order_by, select.limit, select.offset) == (
+        'accounts', [('amount', True), ('id', False)], 5, 10)
+    insert = Parser('insert into t (a, b) values (1, "x y"), (2, ?);').parse()
+    assert isinstance(insert, Insert)
+    assert insert.columns == ['a', 'b']
+    assert insert.rows[0] == ['1', 'x y'] and isinstance(insert.rows[1][1], Parameter)
+    assert isinstance(Parser('delete from t;').parse(), Delete)
+
+
+@pytest.mark.parametrize('query', [
+    'select from t where a == 1 or;',
+    'select from t where (a == 1;',
+    'select from t where a 1;',
+    'select from t limit x;',
+    'drop table t;',
+    'select from t where a == "unterminated;',
+])
+def test_invalid_queries_raise(query):
+    with pytest.raises(RuntimeError, match='Invalid query'):
+        Parser(query).parse()
@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+from conftest import rows
+from database import truncate_torn_tail
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path, newline='') as f:
+        return f.read()
+
+
+def test_committed_journal_blocks_are_replayed(open_db, storage):
+    write(os.path.join(storage, 'database.journal'),
+          'accounts,insert,1,7,100,first\r\n'
+          'commit\r\n'
+          'accounts,insert,2,7,200,not committed\r\n'
+          'accounts,insert,3,7,300,torn')
+    db = open_db()
+    assert rows(db) == {1: {'id': 1, 'owner': 7, 'amount': 100, 'note': 'first'}}
+    assert read(os.path.join(storage, 'database.journal')) == ''
+    db.prepare(INSERT).execute(8, 50, 'next')
+    assert sorted(rows(db)) == [1, 2]
+
+
+def test_commit_survives_losing_the_unsynced_table_log(open_db, storage):
+    db = open_db()
+    with db.transaction():
+        db.prepare(INSERT).execute(1, 100, 'a')
+        db.prepare(INSERT).execute(2, 200, 'b')
+    # the crash happens before the table log reached the disk, only the synced journal is left
+    write(os.path.join(storage, 'accounts.log'), '')
+    assert rows(open_db()) == rows(db)
+
+
+def test_replaying_records_already_in_the_table_log_is_harmless(open_db):
+    db = open_db()
+    db.prepare(INSERT).execute(1, 100, 'a')
+    db.run_query('update accounts set amount = amount + 5 where id == 1;')
+    db.run_query('delete from accounts where owner == 1;')
+    db.prepare(INSERT).execute(2, 200, 'b')
+    restarted = open_db()
+    assert rows(restarted) == {2: {'id': 2, 'owner': 2, 'amount': 200, 'note': 'b'}}
+    assert restarted.run_query('select from accounts where owner == 1;') == []
+
+
+def test_torn_table_log_tail_is_dropped(open_db, storage):
+    write(os.path.join(storage, 'accounts.log'), 'insert,1,7,100,whole\r\ninsert,2,7,20')
+    db = open_db()
+    assert list(rows(db)) == [1]
+    # the log is folded into the snapshot so the next record does not extend the torn one
+    assert read(os.path.join(storage, 'accounts.log')) == ''
+    db.prepare(INSERT).execute(8, 50, 'next')
+    assert sorted(rows(open_db())) == [1, 2]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('a\nb\nc', 'a\nb\n'),
+    ('a\nb\n', 'a\nb\n'),
+    ('abc', ''),
+    ('', ''),
+])
+def test_truncate_torn_tail(tmp_path, text, expected):
+    path = str(tmp_path / 'table.log')
+    write(path, text)
+    truncate_torn_tail(path)
+    assert read(path) == expected
+
+
+def test_rollback_undoes_every_write(open_db):
+    db = open_db()
+    db.prepare(INSERT).execute(1, 100, 'a')
+    db.prepare(INSERT).execute(2, 200, 'b')
+    before = rows(db)
+    with pytest.raises(RuntimeError, match='abort'):
+        with db.transaction():
+            db.run_query('update accounts set amount = amount * 2, owner = 5 where id == 1;')
+            db.run_query('delete from accounts where id == 2;')
+            db.prepare(INSERT).execute(5, 300, 'c')
+            raise RuntimeError('abort')
+    assert rows(db) == before
+    assert [row['id'] for row in db.run_query('select from accounts where owner == 5;')] == []
+    assert [row['id'] for row in db.run_query('select from accounts where amount >= 150;')] == [2]
+    assert rows(open_db()) == before
+
+
+def test_failed_commit_is_undone(open_db, storage, monkeypatch):
+    db = open_db()
+    db.prepare(INSERT).execute(1, 100, 'a')
+    before = rows(db)
+    journal = read(os.path.join(storage, 'database.journal'))
+
+    def fail(fd):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'fsync', fail)
+    with pytest.raises(OSError):
+        db.prepare(INSERT).execute(2, 200, 'b')
+    with pytest.raises(OSError):
+        with db.transaction():
+            db.run_query('update accounts set amount = 5 where id == 1;')
+            db.run_query('delete from accounts where owner == 1;')
+    monkeypatch.undo()
+
+    assert rows(db) == before
+    assert db.run_query('select from accounts where amount >= 100;')[0]['id'] == 1
+    assert read(os.path.join(storage, 'database.journal')) == journal
+    db.prepare(INSERT).execute(3, 300, 'c')
+    assert sorted(rows(open_db())) == [1, 3]
+
+
+def test_deleted_ids_are_not_reused_without_a_sequence_file(open_db, storage):
+    db = open_db()
+    for owner in range(1, 4):
+        db.prepare(INSERT).execute(owner, 100, 'a')
+    db.checkpoint()
+    db.close()
+    # tables written before sequences were persisted have no .seq file
+    os.remove(os.path.join(storage, 'accounts.seq'))
+    db = open_db()
+    db.run_query('delete from accounts where id == 3;')
+    db.close()
+    os.remove(os.path.join(storage, 'accounts.seq'))
+    db = open_db()
+    db.prepare(INSERT).execute(4, 100, 'b')
+    assert sorted(rows(db)) == [1, 2, 4]
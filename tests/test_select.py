@@ -0,0 +1,73 @@
+import os
+import threading
+
+import pytest
+
+import database
+from database import Database
+from conftest import rows
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+def test_iter_query_reads_rows_as_the_caller_iterates(open_db, monkeypatch):
+    monkeypatch.setattr(database, 'STREAM_BATCH_ROWS', 2)
+    db = open_db()
+    for owner in range(1, 6):
+        db.prepare(INSERT).execute(owner, owner * 10, 'a')
+    db.get_table('accounts').lock.timeout = 1
+    selected = db.iter_query('select from accounts where note == a;')
+    assert next(selected)['id'] == 1
+
+    def write():
+        db.run_query('update accounts set amount = 999 where note == a;')
+        db.run_query('delete from accounts where id == 4;')
+
+    # the open iterator holds no lock, so writers are not blocked by it
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join()
+    # the first batch was read before the writes, the others after them
+    assert [(row['id'], row['amount']) for row in selected] == [(2, 20), (3, 999), (5, 999)]
+    assert [row['id'] for row in db.iter_query('select from accounts where owner == 5 limit 1;')] == [5]
+    assert len(rows(db)) == 4
+
+
+@pytest.fixture
+def ordered(open_db):
+    db = open_db()
+    for owner, amount in [(3, 30), (1, 10), (2, 30), (1, 20), (2, 5)]:
+        db.prepare(INSERT).execute(owner, amount, 'a')
+    return db
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('select from accounts order by amount;', [5, 2, 4, 1, 3]),
+    ('select from accounts order by amount desc;', [3, 1, 4, 2, 5]),
+    ('select from accounts order by amount desc, id desc limit 2;', [3, 1]),
+    ('select from accounts order by owner, amount desc;', [4, 2, 3, 5, 1]),
+    ('select from accounts where amount >= 10 order by amount limit 2 offset 1;', [4, 1]),
+    ('select from accounts limit 2 offset 3;', [4, 5]),
+    ('select from accounts where owner == 2 order by amount limit 1;', [5]),
+])
+def test_order_limit_offset(ordered, query, expected):
+    assert [row['id'] for row in ordered.run_query(query)] == expected
+    assert [row['id'] for row in ordered.iter_query(query)] == expected
+
+
+def test_show_list_reads_a_page_per_query(storage, monkeypatch, capsys):
+    models = pytest.importorskip('models')
+    db = Database(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'schema.txt'), storage)
+    for number in range(5):
+        models.Transaction(models.BaseModel(db, 'accounts')).new_transaction({
+            'account_id': 1, 'destination_id': 2, 'amount': 10, 'description': f'payment {number}',
+            'created_time': '2024-01-01T00:00:00'})
+    answers = iter(['y', 'y'])
+    monkeypatch.setattr('builtins.input', lambda prompt: next(answers))
+    models.Transaction(models.BaseModel(db, 'accounts')).show_list({'id': 1, 'amount': 50}, page_size=2)
+    db.close()
+    output = capsys.readouterr().out
+    # the last page is shorter than a page, so no third question is asked
+    assert next(answers, None) is None
+    assert [output.index(f'payment {number}') for number in range(5)] == sorted(
+        output.index(f'payment {number}') for number in range(5))
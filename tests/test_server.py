@@ -0,0 +1,83 @@
+import os
+import time
+import asyncio
+import threading
+
+import pytest
+
+from client import RemoteDatabase
+from server import serve
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+@pytest.fixture
+def address(open_db, tmp_path):
+    """Unix socket of a server running in another thread, stopped at the end of the test."""
+    path = str(tmp_path / 'db.sock')
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(serve(open_db(), unix_path=path))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    yield path
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join()
+    loop.close()
+
+
+@pytest.fixture
+def remote(address):
+    remote = RemoteDatabase(address)
+    yield remote
+    remote.close()
+
+
+def test_queries_round_trip(remote):
+    remote.prepare(INSERT).execute(1, 10, 'a')
+    remote.insert_many('accounts', [{'owner': 2, 'amount': 20, 'note': 'b "quoted"'}])
+    assert remote.run_query('select from accounts where owner == 2;') == [
+        {'id': 2, 'owner': 2, 'amount': 20, 'note': 'b "quoted"'}]
+    assert [row['id'] for row in remote.prepare('select from accounts where amount >= ?;').iter(5)] == [1, 2]
+    assert remote.next_value('accounts', 'id') == 3
+    assert remote.metrics()['counters']['rows_returned']['accounts'] == 3
+
+
+def test_errors_come_back_as_runtime_errors(remote):
+    with pytest.raises(RuntimeError, match='does not exists'):
+        remote.run_query('select from missing;')
+    with pytest.raises(RuntimeError, match='Invalid query'):
+        remote.run_query('select from accounts where;')
+    assert remote.run_query('select from accounts;') == []
+
+
+def test_transactions_are_atomic_and_isolated(remote, address):
+    other = RemoteDatabase(address)
+    try:
+        with pytest.raises(RuntimeError, match='abort'):
+            with remote.transaction():
+                remote.prepare(INSERT).execute(1, 10, 'a')
+                raise RuntimeError('abort')
+        assert other.run_query('select from accounts;') == []
+
+        remote.begin()
+        remote.prepare(INSERT).execute(1, 10, 'a')
+        seen = []
+        # the other client waits until the transaction ends, so it never reads the uncommitted row
+        reader = threading.Thread(target=lambda: seen.extend(other.run_query('select from accounts;')))
+        reader.start()
+        time.sleep(0.05)
+        assert not seen
+        remote.commit()
+        reader.join()
+        assert [row['id'] for row in seen] == [2]
+    finally:
+        other.close()
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from conftest import rows
+from storage import convert
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+def fill(db):
+    for owner in range(1, 31):
+        db.prepare(INSERT).execute(owner, owner * 10, f'note {owner}')
+    db.checkpoint()
+    # left in the log, the converter has to apply it on top of the snapshot
+    db.run_query('update accounts set amount = 1 where id == 3;')
+    db.run_query('delete from accounts where id == 4;')
+    db.prepare(INSERT).execute(40, 400, 'only in the log')
+
+
+def test_convert_keeps_the_rows_in_the_log(open_db, storage):
+    db = open_db()
+    fill(db)
+    expected = rows(db)
+    db.close()
+
+    convert(open_db('binary'), 'accounts', 'binary')
+    assert not os.path.exists(os.path.join(storage, 'accounts.db'))
+    assert os.path.getsize(os.path.join(storage, 'accounts.log')) == 0
+    converted = open_db('binary')
+    assert rows(converted) == expected
+    converted.prepare(INSERT).execute(50, 500, 'after')
+    assert max(rows(converted)) == 32
+
+    converted.close()
+    convert(open_db(), 'accounts', 'csv')
+    assert not os.path.exists(os.path.join(storage, 'accounts.bin'))
+    assert rows(open_db())[32]['note'] == 'after'
+
+
+def test_convert_refuses_a_target_not_in_the_schema(open_db, storage):
+    db = open_db()
+    fill(db)
+    expected = rows(db)
+    db.close()
+    with pytest.raises(RuntimeError, match='in the schema'):
+        convert(open_db(), 'accounts', 'binary')
+    assert not os.path.exists(os.path.join(storage, 'accounts.bin'))
+    assert rows(open_db()) == expected
+
+
+def test_convert_refuses_a_loaded_table_and_the_same_engine(open_db):
+    db = open_db('binary')
+    fill(db)
+    with pytest.raises(RuntimeError, match='in use'):
+        convert(db, 'accounts', 'binary')
+    db.close()
+    with pytest.raises(RuntimeError, match='already stored'):
+        convert(open_db('binary'), 'accounts', 'binary')
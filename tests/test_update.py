@@ -0,0 +1,59 @@
+import pytest
+
+from conftest import rows
+from query import tokenize
+
+INSERT = 'insert into accounts (owner, amount, note) values (?, ?, ?);'
+
+
+@pytest.fixture
+def db(open_db):
+    db = open_db()
+    db.prepare(INSERT).execute(2, 1000, 'a')
+    return db
+
+
+def amount(db):
+    return rows(db)[1]['amount']
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('amount-500', 500),
+    ('amount - 500', 500),
+    ('amount+2*3', 1006),
+    ('(amount+2)*3', 3006),
+    ('amount / 3', 333),
+    ('amount*owner-owner', 1998),
+    ('500-amount', -500),
+])
+def test_set_arithmetic(db, expression, expected):
+    db.run_query(f'update accounts set amount = {expression} where id == 1;')
+    assert amount(db) == expected
+
+
+def test_set_patches_only_the_assigned_columns_and_is_logged(db, open_db):
+    db.prepare('update accounts set amount = amount + ?, note = "x-y" where owner == ?;').execute(5, 2)
+    assert rows(db)[1] == {'id': 1, 'owner': 2, 'amount': 1005, 'note': 'x-y'}
+    assert rows(open_db())[1] == rows(db)[1]
+
+
+@pytest.mark.parametrize('query, message', [
+    ('update accounts set amount = amount-x where id == 1;', 'Invalid value `x`'),
+    ('update accounts set amount = abc where id == 1;', 'Invalid value `abc`'),
+    ('update accounts set amount = amount / 0 where id == 1;', 'Can not compute /'),
+    ('update accounts set id = 5 where id == 1;', 'can not be updated'),
+])
+def test_invalid_assignments_raise(db, query, message):
+    with pytest.raises(RuntimeError, match=message):
+        db.run_query(query)
+    assert amount(db) == 1000
+
+
+def test_minus_is_an_operator_only_after_a_name_number_or_parenthesis():
+    def texts(query):
+        return [token.text for token in tokenize(query)]
+
+    assert texts('a = b-1') == ['a', '=', 'b', '-', '1']
+    assert texts('a = (b)-1') == ['a', '=', '(', 'b', ')', '-', '1']
+    assert texts('a == -1') == ['a', '==', '-1']
+    assert texts('t == 2024-03-01T10:00:00') == ['t', '==', '2024-03-01T10:00:00']